@@ -0,0 +1,190 @@
+# Backtests des modèles Prophet par validation croisée à origine glissante
+#
+# Pour chaque date de coupure ('cutoff'), un modèle de même configuration que le modèle servi
+# est réentraîné sur l'historique intégré au modèle jusqu'à cette date, puis évalué sur les jours
+# suivants (jusqu'à MAX_HORIZON jours) avec les régresseurs de data/. Les coupures sont réparties
+# entre les processus d'un pool de calcul et la prévision de chaque coupure est enregistrée sur
+# le disque, dans {dossier}/{modèle}/{version}/ : un même backtest relancé, ou un backtest
+# sur un autre horizon, ne réentraîne que les coupures absentes ; un modèle réentraîné ou des
+# régresseurs mis à jour (nouvelle version) ont leurs propres fichiers.
+#
+# Les métriques sont calculées par horizon (jours après la coupure) : erreur absolue moyenne (MAE),
+# erreur absolue moyenne en pourcentage (MAPE, jours où la valeur observée est nulle exclus) et
+# couverture de l'intervalle d'incertitude (part des valeurs observées dans [yhat_lower, yhat_upper]).
+#
+#   python backtesting.py total_accidents --horizon 90 --initial 365 --period 45
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from prophet.diagnostics import prophet_copy
+
+import forecasting
+from forecast_cache import file_hash
+from forecasting import registry
+
+BACKTEST_DIR = 'backtests'
+
+# Nombre maximal de jours évalués après chaque coupure (les prévisions enregistrées servent à tous les horizons)
+MAX_HORIZON = 365
+
+# Nombre de processus du pool de calcul des backtests
+BACKTEST_WORKERS = int(os.environ.get('BACKTEST_WORKERS', os.cpu_count() or 1))
+
+
+# Version d'un modèle pour les backtests : empreinte de son fichier déclaré dans le manifeste
+# et de la version de ses régresseurs (utilisés pour l'entraînement et la prévision de chaque coupure)
+def model_version(model_name):
+    versions = (file_hash(registry.source_file(model_name)), forecasting.regressors_version(model_name))
+    return hashlib.sha256(repr(versions).encode()).hexdigest()[:16]
+
+
+# Dates de coupure : la dernière laisse 'horizon' jours d'historique après elle, les précédentes
+# s'en écartent de 'period' jours, et la première laisse au moins 'initial' jours d'entraînement
+def cutoffs(history_dates, horizon, initial, period):
+    first, last = history_dates.min(), history_dates.max()
+    cutoff = last - pd.Timedelta(days=horizon)
+    result = []
+    while cutoff >= first + pd.Timedelta(days=initial):
+        result.append(cutoff)
+        cutoff -= pd.Timedelta(days=period)
+    return sorted(result)
+
+
+def cutoff_path(directory, model_name, version, cutoff, seed):
+    return os.path.join(directory, model_name, version, f"{cutoff:%Y-%m-%d}_s{seed}.parquet")
+
+
+# Historique d'un modèle (ds, y) avec ses régresseurs non standardisés
+def history(model_name):
+    model = registry.model(model_name)
+    df = model.history[['ds', 'y']].reset_index(drop=True)
+    return df.join(forecasting.model_regressors(model_name)[list(model.extra_regressors)], on='ds')
+
+
+# Entraînement et prévision pour une coupure (exécuté dans un processus du pool) : modèle de même
+# configuration entraîné jusqu'à la coupure, prévision des MAX_HORIZON jours suivants enregistrée
+# dans 'path' (ds, cutoff, y, yhat, yhat_lower, yhat_upper)
+def fit_cutoff(model_name, cutoff, seed, path):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    df = history(model_name)
+    model = prophet_copy(registry.model(model_name), cutoff)
+    model.fit(df[df['ds'] <= cutoff])
+
+    test = df[(df['ds'] > cutoff) & (df['ds'] <= cutoff + pd.Timedelta(days=MAX_HORIZON))]
+    np.random.seed(seed)
+    forecast = model.predict(test.drop(columns='y'))
+    result = forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].assign(cutoff=cutoff, y=test['y'].values)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    result.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+# Métriques par horizon (en jours) des prévisions de toutes les coupures, et sur l'ensemble des horizons
+def horizon_metrics(predictions, horizon):
+    df = predictions.assign(horizon=(predictions['ds'] - predictions['cutoff']).dt.days)
+    df = df[df['horizon'] <= horizon]
+    error = (df['y'] - df['yhat']).abs()
+    df = df.assign(
+        error=error,
+        ape=(error / df['y'].abs()).where(df['y'] != 0),
+        covered=((df['y'] >= df['yhat_lower']) & (df['y'] <= df['yhat_upper'])).astype(float),
+    )
+
+    def summary(group):
+        return {
+            'mae': float(group['error'].mean()),
+            'mape': None if group['ape'].isna().all() else float(group['ape'].mean()),
+            'coverage': float(group['covered'].mean()),
+            'count': int(len(group)),
+        }
+
+    by_horizon = [{'horizon': int(h), **summary(group)} for h, group in df.groupby('horizon')]
+    return by_horizon, summary(df)
+
+
+class Backtester:
+    def __init__(self, directory=BACKTEST_DIR, workers=BACKTEST_WORKERS):
+        self.directory = directory
+        self.workers = workers
+
+    # Paramètres d'un backtest : version du modèle et coupures (ValueError si aucune coupure possible)
+    def plan(self, model_name, horizon, initial, period):
+        dates = registry.model(model_name).history['ds']
+        plan = cutoffs(dates, horizon, initial, period)
+        if not plan:
+            raise ValueError(f"Historique trop court pour un horizon de {horizon} jours "
+                             f"après {initial} jours d'entraînement (du {dates.min():%Y-%m-%d} "
+                             f"au {dates.max():%Y-%m-%d})")
+        return model_version(model_name), plan
+
+    # Coupures dont la prévision n'est pas encore enregistrée
+    def missing(self, model_name, version, plan, seed):
+        return [cutoff for cutoff in plan
+                if not os.path.exists(cutoff_path(self.directory, model_name, version, cutoff, seed))]
+
+    # Résultat d'un backtest dont toutes les coupures sont enregistrées
+    def report(self, model_name, version, plan, horizon, initial, period, seed):
+        predictions = pd.concat([
+            pd.read_parquet(cutoff_path(self.directory, model_name, version, cutoff, seed)) for cutoff in plan
+        ], ignore_index=True)
+        by_horizon, overall = horizon_metrics(predictions, horizon)
+        return {
+            'model': model_name,
+            'version': version,
+            'horizon': horizon,
+            'initial': initial,
+            'period': period,
+            'seed': seed,
+            'cutoffs': [f"{cutoff:%Y-%m-%d}" for cutoff in plan],
+            'overall': overall,
+            'metrics': by_horizon,
+        }
+
+    # Backtest complet : entraînement en parallèle des coupures manquantes, puis métriques
+    # ('progress' : fonction appelée avec la part des coupures traitées et un message)
+    async def run(self, model_name, horizon=90, initial=365, period=45, seed=0, progress=None):
+        version, plan = self.plan(model_name, horizon, initial, period)
+        missing = self.missing(model_name, version, plan, seed)
+        if missing:
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(missing)), mp_context=forecasting.process_context()) as pool:
+                futures = [
+                    loop.run_in_executor(pool, fit_cutoff, model_name, cutoff, seed,
+                                         cutoff_path(self.directory, model_name, version, cutoff, seed))
+                    for cutoff in missing
+                ]
+                done = len(plan) - len(missing)
+                for future in asyncio.as_completed(futures):
+                    await future
+                    done += 1
+                    if progress is not None:
+                        progress(done / len(plan), f"{done}/{len(plan)} coupures")
+        return self.report(model_name, version, plan, horizon, initial, period, seed)
+
+
+# Backtest en ligne de commande, avec les modèles et régresseurs des dossiers models/ et data/
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest d'un modèle Prophet par origine glissante")
+    parser.add_argument('model', choices=registry.names())
+    parser.add_argument('--horizon', type=int, default=90)
+    parser.add_argument('--initial', type=int, default=365)
+    parser.add_argument('--period', type=int, default=45)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=BACKTEST_WORKERS)
+    args = parser.parse_args()
+
+    report = asyncio.run(Backtester(workers=args.workers).run(
+        args.model, args.horizon, args.initial, args.period, args.seed,
+        lambda fraction, message: print(message, flush=True),
+    ))
+    print(json.dumps({key: value for key, value in report.items() if key != 'metrics'}, indent=2))
@@ -0,0 +1,216 @@
+# Banc d'essai de charge de l'API Prophet
+#
+# Lance l'API sur localhost (uvicorn dans un processus séparé, avec les modèles et régresseurs réels
+# des dossiers models/ et data/) ou cible une API déjà démarrée (--url), envoie des requêtes de prévision
+# concurrentes sur plusieurs modèles et horizons, puis affiche les latences p50/p95/p99, le débit,
+# le nombre d'erreurs et la mémoire (RSS) du serveur et de ses processus de calcul.
+#
+# Les résultats peuvent être enregistrés comme référence (--save-baseline) dans benchmarks/baseline.json,
+# par scénario ; les exécutions suivantes du même scénario y sont comparées et le script se termine
+# en erreur si p95, p99 ou le débit se dégradent de plus de --threshold (20 % par défaut).
+#
+# Exemples :
+#   python benchmark.py --concurrency 8 --requests 400 --horizons 30,365
+#   python benchmark.py --engine fast --samples 0 --save-baseline
+#   python benchmark.py --url http://localhost:8000 --pid 1234
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+BASELINE_FILE = os.path.join('benchmarks', 'baseline.json')
+
+
+# Mémoire résidente (en Mo) d'un processus et de ses descendants (Linux, None si indisponible)
+def process_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) / 1024
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(process_rss(child) or 0 for child in children)
+
+
+# Port TCP libre sur localhost
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Démarrage de l'API dans un processus uvicorn ; retourne (processus, url) une fois l'API prête
+# (les prévisions des modèles préchargés sont calculées avant que l'API n'accepte des requêtes)
+def start_server(timeout=300):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'prophet_api:app', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("L'API s'est arrêtée pendant son démarrage")
+        try:
+            if httpx.get(url + '/', timeout=1).status_code == 200:
+                return process, url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("L'API n'a pas démarré à temps")
+
+
+# Requêtes du scénario : modèles et horizons tirés avec une graine fixe
+def build_requests(args, models):
+    rng = random.Random(args.seed)
+    params = {'engine': args.engine, 'format': args.format}
+    if args.samples is not None:
+        params['samples'] = args.samples
+    params['include_history'] = 'true' if args.include_history else 'false'
+    return [
+        (f"/predict/{rng.choice(models)}/{rng.choice(args.horizons)}", params)
+        for _ in range(args.requests)
+    ]
+
+
+# Envoi des requêtes par 'concurrency' clients simultanés ; retourne (latences en s, erreurs, durée totale)
+async def run_load(url, requests, concurrency):
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies, errors = [], 0
+
+    async def client(http):
+        nonlocal errors
+        while not queue.empty():
+            path, params = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await http.post(path, params=params)
+                await response.aread()
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+    return latencies, errors, duration
+
+
+# Résultats d'une exécution
+def summarize(latencies, errors, duration, rss):
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    return {
+        'requests': int(len(latencies) + errors),
+        'errors': errors,
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'mean_ms': round(float(latencies.mean()), 2) if len(latencies) else None,
+        'throughput_rps': round(len(latencies) / duration, 2),
+        'rss_mb': round(rss, 1) if rss is not None else None,
+    }
+
+
+# Dégradations par rapport à la référence, au-delà du seuil relatif 'threshold'
+def regressions(result, baseline, threshold):
+    found = []
+    for key in ('p95_ms', 'p99_ms'):
+        if result[key] > baseline[key] * (1 + threshold):
+            found.append(f"{key} : {result[key]} contre {baseline[key]} en référence")
+    if result['throughput_rps'] < baseline['throughput_rps'] * (1 - threshold):
+        found.append(f"throughput_rps : {result['throughput_rps']} contre {baseline['throughput_rps']} en référence")
+    return found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Banc d'essai de charge de l'API Prophet")
+    parser.add_argument('--url', help="URL d'une API déjà démarrée (par défaut l'API est lancée sur localhost)")
+    parser.add_argument('--pid', type=int, help="processus de l'API ciblée par --url, pour mesurer sa mémoire")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20, help="requêtes envoyées avant la mesure")
+    parser.add_argument('--models', help="modèles séparés par des virgules (par défaut ceux de /models)")
+    parser.add_argument('--horizons', default='30,90,365', type=lambda value: [int(h) for h in value.split(',')])
+    parser.add_argument('--engine', default='prophet', choices=['prophet', 'fast'])
+    parser.add_argument('--samples', type=int)
+    parser.add_argument('--format', default='records')
+    parser.add_argument('--include-history', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', help="nom du scénario dans le fichier de référence")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenario = args.scenario or (
+        f"{args.engine}-s{args.samples}-c{args.concurrency}-h{'_'.join(map(str, args.horizons))}-{args.format}"
+        f"{'' if args.include_history else '-nohistory'}"
+    )
+
+    process = None
+    if args.url is None:
+        process, url = start_server()
+        pid = process.pid
+    else:
+        url, pid = args.url.rstrip('/'), args.pid
+    try:
+        models = args.models.split(',') if args.models else [model['name'] for model in httpx.get(url + '/models').json()]
+        warmup = build_requests(argparse.Namespace(**{**vars(args), 'requests': args.warmup}), models)
+        asyncio.run(run_load(url, warmup, args.concurrency))
+        latencies, errors, duration = asyncio.run(run_load(url, build_requests(args, models), args.concurrency))
+        result = summarize(latencies, errors, duration, process_rss(pid) if pid else None)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(f"Scénario {scenario}")
+    print(json.dumps(result, indent=2))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[scenario] = result
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Référence enregistrée dans {args.baseline}")
+    elif scenario in baselines:
+        found = regressions(result, baselines[scenario], args.threshold)
+        for regression in found:
+            print(f"Dégradation : {regression}")
+        if found:
+            sys.exit(1)
+        print(f"Pas de dégradation au-delà de {args.threshold:.0%} par rapport à la référence")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
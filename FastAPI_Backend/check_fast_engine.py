@@ -0,0 +1,55 @@
+# Contrôle de parité du moteur NumPy (fast_engine) avec Prophet.predict
+#
+# Pour chaque modèle servi par l'API (dossiers models/ et data/), compare sur un an de prévisions les
+# valeurs ponctuelles (yhat et composantes) et les bornes simulées des deux moteurs. Le script se termine
+# en erreur si une valeur ponctuelle s'écarte de plus de POINT_TOLERANCE, ou si les bornes simulées
+# s'écartent en moyenne de plus de BOUNDS_TOLERANCE de la largeur de l'intervalle (tirages différents).
+#
+# Exemple :
+#   python check_fast_engine.py
+
+import sys
+
+import numpy as np
+
+import fast_engine
+import forecasting
+
+POINT_TOLERANCE = 1e-4
+BOUNDS_TOLERANCE = 0.1
+
+
+def main():
+    failed = []
+    for model_name in forecasting.registry.names():
+        model = forecasting.registry.model(model_name)
+        spec = fast_engine.extract_spec(model)
+        regressors = forecasting.model_regressors(model_name)
+
+        future = model.make_future_dataframe(periods=365)
+        if regressors is not None:
+            future = future.join(regressors, on='ds')
+        expected = model.predict(future)
+
+        dates = fast_engine.make_future_dates(spec, 365)
+        forecast = fast_engine.predict(spec, dates, forecasting.regressor_values(regressors, spec, dates),
+                                       samples=spec['uncertainty_samples'])
+
+        # Valeurs ponctuelles : écart numérique ; bornes simulées : écart relatif à la largeur de l'intervalle
+        points = [col for col in forecast.columns if col != 'ds' and not col.endswith(('_lower', '_upper'))]
+        gap = max(np.abs(forecast[col].values - expected[col].values).max() for col in points)
+        width = (expected['yhat_upper'] - expected['yhat_lower']).mean()
+        bounds = max(np.abs(forecast[col] - expected[col]).mean() / width for col in ('yhat_lower', 'yhat_upper'))
+        ok = gap <= POINT_TOLERANCE and bounds <= BOUNDS_TOLERANCE
+        if not ok:
+            failed.append(model_name)
+        print(f"{model_name}: écart absolu maximal = {gap:.2e}, "
+              f"écart moyen des bornes de yhat = {bounds:.1%} de la largeur de l'intervalle"
+              f"{'' if ok else ' : ÉCHEC'}")
+
+    if failed:
+        sys.exit(f"Parité avec Prophet non respectée pour : {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Compression gzip des réponses de l'API
+#
+# GZipMiddleware de Starlette, sauf pour les types de contenu de UNCOMPRESSED_MEDIA_TYPES : ces réponses
+# sont envoyées telles quelles. Les événements envoyés par le serveur (text/event-stream, voir
+# /jobs/{job_id}/events) sont de petits messages qui doivent arriver dès leur envoi ; compressés, ils
+# resteraient dans le tampon du compresseur jusqu'à la fin du flux.
+# Les autres réponses envoyées en flux (prévisions en NDJSON ou en Arrow IPC, voir
+# prophet_api.streaming_response) restent compressées, mais chaque morceau est vidé du compresseur
+# (Z_SYNC_FLUSH) dès qu'il est écrit : le client reçoit et décode chaque morceau à son envoi, au prix de
+# quelques octets par morceau.
+
+import gzip
+import io
+
+from starlette.datastructures import Headers
+from starlette.middleware import gzip as starlette_gzip
+
+UNCOMPRESSED_MEDIA_TYPES = ('text/event-stream',)
+
+
+# Type de contenu (sans paramètres) d'un message 'http.response.start'
+def media_type(message):
+    return Headers(raw=message['headers']).get('content-type', '').split(';')[0].strip().lower()
+
+
+# Fichier gzip vidé (Z_SYNC_FLUSH) après chaque écriture
+class SyncFlushGzipFile(gzip.GzipFile):
+    def write(self, data):
+        length = super().write(data)
+        self.flush()
+        return length
+
+
+class GZipResponder(starlette_gzip.GZipResponder):
+    def __init__(self, app, minimum_size, compresslevel=9):
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        self.gzip_buffer = io.BytesIO()
+        self.gzip_file = SyncFlushGzipFile(mode='wb', fileobj=self.gzip_buffer, compresslevel=compresslevel)
+
+    async def send_with_gzip(self, message):
+        await super().send_with_gzip(message)
+        if message['type'] == 'http.response.start' and media_type(message) in UNCOMPRESSED_MEDIA_TYPES:
+            # Réponse transmise sans modification, comme une réponse déjà encodée
+            self.content_encoding_set = True
+
+
+class GZipMiddleware(starlette_gzip.GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and 'gzip' in Headers(scope=scope).get('Accept-Encoding', ''):
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,229 @@
+# Prévisions par département : pipeline d'entraînement des modèles départementaux
+#
+# 1. Séries journalières : les données brutes (un usager accidenté par ligne, comme data/df_accidents.csv
+#    produit par le notebook TS_1) sont comptées par département et par jour, au total ('total_accidents')
+#    et par gravité ('gravite_accident_{modalité}'), sur la même plage de dates pour tous les départements
+#    (jours sans accident à 0). Les séries comptant moins de --min-accidents accidentés sont ignorées.
+# 2. Entraînement : chaque série a son modèle, nommé {série}_{département} (par exemple total_accidents_75),
+#    avec la configuration du modèle national de la même série (saisonnalités, jours fériés, a priori) sans
+#    ses régresseurs, qui sont des agrégats nationaux. Les modèles sont entraînés dans un pool de processus ;
+#    l'échec d'un modèle n'interrompt pas les autres. Comme dans training.py, un modèle dont la série n'a
+#    pas changé n'est pas réentraîné (sauf --force) et une série qui prolonge l'historique du modèle actuel
+#    part de ses paramètres (démarrage à chaud).
+# 3. Magasin de modèles : models/departments/ contient les modèles au format binaire (model_artifact.py),
+#    dans versions/{version}/, et leur manifeste manifest.json (fichier, département, nom du département,
+#    série) écrit en dernier. L'API les sert comme les modèles nationaux (voir forecasting.registry_of) :
+#    chaque modèle est chargé à sa première utilisation, ses tableaux projetés en mémoire, et les modèles
+#    les moins récemment utilisés sont libérés au-delà de DEPARTMENT_MEMORY_MB Mo.
+#
+# Exemples :
+#   python departments.py --accidents ../Streamlit_Frontend/data/df_accidents.csv
+#   python departments.py --accidents data/df_accidents.csv --departments 75,13,69 --series total_accidents
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import pandas as pd
+from prophet import Prophet
+from prophet.diagnostics import prophet_copy
+
+import model_artifact
+import training
+from model_registry import ModelRegistry, load_model
+
+DEPARTMENTS_DIR = os.path.join('models', 'departments')
+
+# Séries modélisées pour chaque département (modèles nationaux de même nom utilisés comme configuration)
+SERIES = ['total_accidents', *training.GRAVITY_COLUMNS]
+
+
+def model_name(department, series):
+    return f"{series}_{department}"
+
+
+# Séries journalières par département : {(département, série): série indexée par 'ds'} et noms des départements.
+# Le département est identifié par la colonne 'departement' (à défaut par 'nom_dep').
+def department_series(accidents_path):
+    columns = {'date', 'departement', 'nom_dep', 'gravite_accident'}
+    df = pd.read_csv(accidents_path, usecols=lambda column: column in columns, parse_dates=['date'],
+                     dtype={'departement': str, 'nom_dep': str})
+    df = df[df['gravite_accident'] != 'autre']
+    key = 'departement' if 'departement' in df.columns else 'nom_dep'
+    df[key] = df[key].str.strip()
+    names = df.groupby(key)['nom_dep'].first() if 'nom_dep' in df.columns else None
+
+    counts = pd.crosstab([df[key], df['date']], 'gravite_accident_' + df['gravite_accident'])
+    counts['total_accidents'] = counts.reindex(columns=training.GRAVITY_COLUMNS, fill_value=0).sum(axis=1)
+    dates = pd.date_range(df['date'].min(), df['date'].max(), freq='D', name='ds')
+    series = {}
+    for department, frame in counts.groupby(level=0):
+        daily = frame.droplevel(0).reindex(index=dates, columns=SERIES, fill_value=0).astype(float)
+        for name in SERIES:
+            series[(department, name)] = daily[name]
+    return series, ({} if names is None else names.to_dict())
+
+
+# Nouveau modèle (non entraîné) avec la configuration d'un modèle national, sans ses régresseurs
+def department_model(template):
+    model = Prophet(
+        growth=template.growth,
+        n_changepoints=template.n_changepoints,
+        changepoint_range=template.changepoint_range,
+        yearly_seasonality=False,
+        weekly_seasonality=False,
+        daily_seasonality=False,
+        holidays=template.holidays,
+        seasonality_mode=template.seasonality_mode,
+        seasonality_prior_scale=template.seasonality_prior_scale,
+        holidays_prior_scale=template.holidays_prior_scale,
+        changepoint_prior_scale=template.changepoint_prior_scale,
+        mcmc_samples=template.mcmc_samples,
+        interval_width=template.interval_width,
+        uncertainty_samples=template.uncertainty_samples,
+    )
+    for name, props in template.seasonalities.items():
+        model.add_seasonality(name=name, period=props['period'], fourier_order=props['fourier_order'],
+                              prior_scale=props['prior_scale'], mode=props['mode'],
+                              condition_name=props['condition_name'])
+    return model
+
+
+# Entraînement d'un modèle départemental (exécuté dans un processus du pool) sur 'df' (ds, y), à partir
+# du modèle actuel 'current_file' s'il existe, sinon de la configuration du modèle national 'template_file' ;
+# le modèle est écrit au format binaire dans 'path' et ses informations d'entraînement sont retournées
+def fit_series(template_file, current_file, df, path, warm=True):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    current = load_model(current_file) if current_file else None
+    warm = warm and current is not None and current.mcmc_samples == 0 and training.extends_history(current, df)
+    model = prophet_copy(current) if current is not None else department_model(load_model(template_file))
+    start = time.perf_counter()
+    model.fit(df, **({'init': training.stan_init(current)} if warm else {}))
+    model_artifact.save_artifact(model, path)
+    return {
+        'rows': len(df),
+        'accidents': int(df['y'].sum()),
+        'first_date': f"{df['ds'].min():%Y-%m-%d}",
+        'last_date': f"{df['ds'].max():%Y-%m-%d}",
+        'warm_start': warm,
+        'fit_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Entraînement des modèles Prophet départementaux")
+    parser.add_argument('--accidents', required=True, help="données brutes (format de df_accidents.csv)")
+    parser.add_argument('--models-dir', default='models', help="dossier des modèles nationaux (configurations)")
+    parser.add_argument('--store', default=DEPARTMENTS_DIR, help="dossier des modèles départementaux")
+    parser.add_argument('--departments', help="départements à modéliser, séparés par des virgules (par défaut tous)")
+    parser.add_argument('--series', help=f"séries à modéliser, séparées par des virgules (parmi {', '.join(SERIES)})")
+    parser.add_argument('--min-accidents', type=int, default=100,
+                        help="nombre minimal d'accidentés sur l'historique pour modéliser une série")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cold', action='store_true', help="sans démarrage à chaud")
+    parser.add_argument('--force', action='store_true', help="réentraîner aussi les modèles dont la série n'a pas changé")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    national = ModelRegistry(args.models_dir)
+    store = ModelRegistry(args.store)
+    series_names = args.series.split(',') if args.series else SERIES
+    unknown = [name for name in series_names if name not in SERIES or name not in national]
+    if unknown:
+        raise SystemExit(f"Séries inconnues ou sans modèle national : {', '.join(unknown)}")
+
+    series, department_names = department_series(args.accidents)
+    departments = args.departments.split(',') if args.departments else sorted({d for d, _ in series})
+    dates = next(iter(series.values())).index
+    print(f"{len(departments)} départements, séries du {dates.min():%Y-%m-%d} au {dates.max():%Y-%m-%d}", flush=True)
+
+    # Séries à entraîner ; les séries trop peu fournies et celles dont le modèle actuel a la même série sont ignorées
+    current = store.manifest()
+    frames, sparse, unchanged = {}, [], []
+    for department in departments:
+        for name in series_names:
+            values = series.get((department, name))
+            if values is None or values.sum() < args.min_accidents:
+                sparse.append(model_name(department, name))
+                continue
+            df = values.rename('y').reset_index()
+            key = model_name(department, name)
+            if not args.force and key in current:
+                model = store.model(key)
+                if len(df) == len(model.history) and training.extends_history(model, df):
+                    unchanged.append(key)
+                    continue
+            frames[key] = (department, name, df)
+    print(f"{len(frames)} modèles à entraîner, {len(unchanged)} inchangés, "
+          f"{len(sparse)} séries ignorées (moins de {args.min_accidents} accidentés)", flush=True)
+    if not frames:
+        return
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    directory = os.path.join(args.store, training.VERSIONS_DIR, version)
+    os.makedirs(directory)
+    report = {'version': version, 'created': datetime.now(timezone.utc).isoformat(), 'models': {}}
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(frames)), mp_context=context) as pool:
+        futures = {
+            pool.submit(fit_series, national.model_file(name), store.model_file(key) if key in current else None,
+                        df, os.path.join(directory, f"{key}{model_artifact.ARTIFACT_SUFFIX}"), not args.cold): key
+            for key, (department, name, df) in frames.items()
+        }
+        failed = {}
+        for done, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            department, name, _ = frames[key]
+            try:
+                info = future.result()
+            except Exception as error:
+                failed[key] = str(error)
+                print(f"[{done}/{len(futures)}] {key} : échec de l'entraînement ({error})", flush=True)
+                continue
+            report['models'][key] = {
+                'file': os.path.join(training.VERSIONS_DIR, version, f"{key}{model_artifact.ARTIFACT_SUFFIX}"),
+                'department': department,
+                'nom_dep': department_names.get(department),
+                'series': name,
+                **info,
+            }
+            print(f"[{done}/{len(futures)}] {key} : {info['accidents']} accidentés, "
+                  f"{'démarrage à chaud' if info['warm_start'] else 'démarrage à froid'}, "
+                  f"entraîné en {info['fit_seconds']:.2f} s", flush=True)
+
+    if not report['models']:
+        shutil.rmtree(directory)
+        raise SystemExit(1)
+    report['failed'] = failed
+    report['wall_seconds'] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(directory, training.TRAINING_FILE), 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    # Manifeste du magasin (écrit en dernier) : modèles actuels, remplacés par ceux de cette version
+    manifest = {key: dict(entry) for key, entry in current.items()}
+    for key, entry in report['models'].items():
+        manifest[key] = {
+            'file': entry['file'], 'regressors': None, 'department': entry['department'],
+            'nom_dep': entry['nom_dep'], 'series': entry['series'], 'version': version,
+        }
+    training.write_manifest(store.manifest_path(), dict(sorted(manifest.items())))
+
+    print(f"Version {version} : {len(report['models'])} modèles entraînés en {report['wall_seconds']:.2f} s "
+          f"(durées d'entraînement cumulées : {sum(e['fit_seconds'] for e in report['models'].values()):.2f} s)")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
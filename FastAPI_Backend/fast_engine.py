@@ -0,0 +1,394 @@
+# Moteur de prévision NumPy pour les modèles Prophet
+#
+# Les prévisions ponctuelles (yhat et composantes) sont évaluées directement à partir des
+# paramètres du modèle désérialisé : tendance linéaire par morceaux, séries de Fourier des
+# saisonnalités, indicatrices des jours fériés et régresseurs standardisés, combinés par
+# quelques produits matriciels au lieu de passer par Prophet.predict et ses DataFrames.
+# Les intervalles d'incertitude sont simulés comme dans Prophet (tendances futures et bruit
+# d'observation), en une seule passe vectorisée, avec un générateur aléatoire initialisé
+# par une graine pour que le résultat soit reproductible.
+
+import numpy as np
+import pandas as pd
+
+import feature_cache
+
+NANOSECONDS_PER_DAY = 86400 * 10**9
+
+
+# Fonction pour extraire d'un modèle Prophet entraîné tout ce qu'il faut pour le prédire.
+# Le résultat est un dictionnaire de scalaires, de listes et de tableaux NumPy.
+def extract_spec(model):
+    if model.growth not in ('linear', 'flat'):
+        raise ValueError(f"Croissance '{model.growth}' non prise en charge par le moteur rapide")
+    if model.logistic_floor or model.country_holidays is not None:
+        raise ValueError("Plancher logistique et jours fériés par pays non pris en charge par le moteur rapide")
+    if any(props['condition_name'] is not None for props in model.seasonalities.values()):
+        raise ValueError("Saisonnalités conditionnelles non prises en charge par le moteur rapide")
+
+    # Saisonnalités, dans l'ordre des colonnes de Prophet.make_all_seasonality_features
+    seasonalities = [
+        {'name': name, 'period': float(props['period']), 'fourier_order': int(props['fourier_order'])}
+        for name, props in model.seasonalities.items()
+    ]
+
+    # Jours fériés : une indicatrice par (jour férié, décalage), colonnes triées par nom comme dans Prophet
+    holiday_days = {}
+    if model.holidays is not None:
+        holidays = model.holidays
+        if model.train_holiday_names is not None:
+            holidays = holidays[holidays['holiday'].isin(model.train_holiday_names)]
+        for row in holidays.itertuples():
+            day = pd.Timestamp(row.ds).normalize().value // NANOSECONDS_PER_DAY
+            lower = int(getattr(row, 'lower_window', 0))
+            upper = int(getattr(row, 'upper_window', 0))
+            for offset in range(lower, upper + 1):
+                key = '{}_delim_{}{}'.format(row.holiday, '+' if offset >= 0 else '-', abs(offset))
+                holiday_days.setdefault(key, []).append(day + offset)
+    holiday_features = sorted(holiday_days)
+
+    regressors = list(model.extra_regressors)
+
+    # Paramètres par itération d'échantillonnage (une seule itération pour une estimation MAP)
+    n_iterations = model.params['k'].shape[0]
+    params = {
+        'k': model.params['k'].reshape(n_iterations).astype(float),
+        'm': model.params['m'].reshape(n_iterations).astype(float),
+        'delta': model.params['delta'].reshape(n_iterations, -1).astype(float),
+        'beta': model.params['beta'].reshape(n_iterations, -1).astype(float),
+        'sigma_obs': model.params['sigma_obs'].reshape(n_iterations).astype(float),
+    }
+    n_features = sum(2 * s['fourier_order'] for s in seasonalities) + len(holiday_features) + len(regressors)
+    if n_features != params['beta'].shape[1]:
+        raise ValueError("Les variables reconstruites ne correspondent pas aux coefficients du modèle")
+
+    components = model.train_component_cols
+    return {
+        'growth': model.growth,
+        'start': model.start.value,
+        't_scale': model.t_scale.value,
+        'y_scale': float(model.y_scale),
+        'interval_width': float(model.interval_width),
+        'uncertainty_samples': int(model.uncertainty_samples),
+        'params': params,
+        'changepoints_t': np.asarray(model.changepoints_t, dtype=float),
+        'history_dates': model.history_dates.values.astype('datetime64[ns]'),
+        'seasonalities': seasonalities,
+        'holiday_features': holiday_features,
+        'holiday_days': [np.array(holiday_days[key], dtype=np.int64) for key in holiday_features],
+        'holiday_key': feature_cache.holiday_key(holiday_features, [holiday_days[key] for key in holiday_features]),
+        'regressors': regressors,
+        'regressor_mu': np.array([model.extra_regressors[r]['mu'] for r in regressors], dtype=float),
+        'regressor_std': np.array([model.extra_regressors[r]['std'] for r in regressors], dtype=float),
+        'components': list(components.columns),
+        'component_cols': components.values.astype(float),
+        'additive_components': [c for c in components.columns if c in model.component_modes['additive']],
+    }
+
+
+# Dates de prévision : l'historique (si demandé) suivi de 'periods' jours
+# (équivalent à Prophet.make_future_dataframe(periods, freq='D'))
+def make_future_dates(spec, periods, include_history=True):
+    history = spec['history_dates']
+    last = history[-1]
+    future = last + np.arange(1, periods + 1) * np.timedelta64(1, 'D')
+    if include_history:
+        return np.concatenate((history, future))
+    return future
+
+
+# Tendance (linéaire par morceaux ou plate) sur l'échelle des données
+def predict_trend(spec, t, k, m, deltas):
+    if spec['growth'] == 'flat':
+        return np.full_like(t, m) * spec['y_scale']
+    deltas_t = (spec['changepoints_t'][None, :] <= t[:, None]) * deltas
+    k_t = deltas_t.sum(axis=1) + k
+    m_t = (deltas_t * -spec['changepoints_t']).sum(axis=1) + m
+    return (k_t * t + m_t) * spec['y_scale']
+
+
+# Simulation de 'n_samples' écarts de tendance future (nuls sur l'historique), standardisés,
+# comme Prophet._sample_uncertainty : changements de pente tirés selon la fréquence et
+# l'amplitude moyenne des changements de pente observés sur l'historique
+def sample_trend_uncertainty(spec, t, deltas, n_samples, rng):
+    uncertainty = np.zeros((n_samples, len(t)))
+    future = t > 1
+    n_future = int(future.sum())
+    if n_future == 0 or spec['growth'] == 'flat':
+        return uncertainty
+
+    if n_future > 1:
+        step = np.diff(t[future]).mean()
+    else:
+        history = spec['history_dates'].astype(np.int64)
+        step = (history[-1] - history[0]) / (len(history) - 1) / spec['t_scale']
+    likelihood = len(spec['changepoints_t']) * step
+    mean_delta = np.mean(np.abs(deltas)) + 1e-8
+
+    shifts = rng.laplace(0, mean_delta, size=(n_samples, n_future))
+    shifts *= rng.uniform(size=(n_samples, n_future)) < likelihood
+    shifts[:, 1:] += shifts[:, :-1].copy()
+    shifts /= 2
+    uncertainty[:, future] = shifts.cumsum(axis=1).cumsum(axis=1) * step
+    return uncertainty
+
+
+# Matrice des variables explicatives : séries de Fourier, jours fériés puis régresseurs standardisés.
+# Les variables de saisonnalité et de jours fériés sont lues dans le cache partagé (voir feature_cache.py).
+def design_matrix(spec, dates, regressors):
+    blocks = [feature_cache.seasonality_features(dates, seasonality['period'], seasonality['fourier_order'])
+              for seasonality in spec['seasonalities']]
+
+    if spec['holiday_features']:
+        blocks.append(feature_cache.holiday_features(dates, spec['holiday_features'], spec['holiday_days'],
+                                                     spec.get('holiday_key')))
+
+    if spec['regressors']:
+        values = np.asarray(regressors, dtype=float)
+        if np.isnan(values).any():
+            raise ValueError("Valeurs de régresseurs manquantes sur la période demandée")
+        blocks.append((values - spec['regressor_mu']) / spec['regressor_std'])
+
+    return np.hstack(blocks) if blocks else np.empty((len(dates), 0))
+
+
+# Prévision (trend, composantes, yhat) pour les dates données.
+# 'regressors' est un tableau (len(dates), nombre de régresseurs) dans l'ordre de spec['regressors'].
+# Avec samples > 0, les bornes *_lower / *_upper sont estimées sur 'samples' simulations
+# tirées avec la graine 'seed' ; avec samples = 0 seules les valeurs ponctuelles sont calculées.
+# 'components' limite le calcul à certaines composantes (additive_terms et multiplicative_terms
+# sont toujours calculées car yhat en dépend).
+def predict(spec, dates, regressors=None, samples=0, seed=0, components=None):
+    params = spec['params']
+    t = (dates.astype('datetime64[ns]').astype(np.int64) - spec['start']) / spec['t_scale']
+    trend = predict_trend(
+        spec, t, np.nanmean(params['k']), np.nanmean(params['m']), np.nanmean(params['delta'], axis=0)
+    )
+
+    if components is None:
+        selected = np.arange(len(spec['components']))
+    else:
+        wanted = set(components) | {'additive_terms', 'multiplicative_terms'}
+        selected = np.array([j for j, c in enumerate(spec['components']) if c in wanted])
+    names = [spec['components'][j] for j in selected]
+    component_cols = spec['component_cols'][:, selected]
+
+    X = design_matrix(spec, dates, regressors)
+    scale = np.where(np.isin(names, spec['additive_components']), spec['y_scale'], 1.)
+    values = X @ (np.nanmean(params['beta'], axis=0)[:, None] * component_cols) * scale
+
+    columns = {'ds': dates, 'trend': trend}
+    if samples:
+        columns.update(predict_intervals(spec, t, X, samples, seed))
+    lower_p, upper_p = interval_percentiles(spec)
+    for j, component in enumerate(names):
+        columns[component] = values[:, j]
+        if samples and len(params['beta']) == 1:
+            # Estimation MAP : les bornes des composantes sont confondues avec leur valeur
+            columns[component + '_lower'] = values[:, j]
+            columns[component + '_upper'] = values[:, j]
+        elif samples:
+            # Bornes des composantes : dispersion des coefficients entre itérations MCMC
+            comp = X @ (params['beta'] * component_cols[:, j]).T * scale[j]
+            columns[component + '_lower'] = np.percentile(comp, lower_p, axis=1)
+            columns[component + '_upper'] = np.percentile(comp, upper_p, axis=1)
+
+    forecast = pd.DataFrame(columns)
+    forecast['yhat'] = trend * (1 + forecast['multiplicative_terms']) + forecast['additive_terms']
+    return forecast
+
+
+# Percentiles des bornes de l'intervalle d'incertitude
+def interval_percentiles(spec):
+    return 100 * (1.0 - spec['interval_width']) / 2, 100 * (1.0 + spec['interval_width']) / 2
+
+
+# Intervalles de yhat et de la tendance estimés sur 'samples' simulations réparties entre les
+# itérations d'échantillonnage (comme Prophet.sample_posterior_predictive en mode vectorisé)
+def predict_intervals(spec, t, X, samples, seed):
+    params = spec['params']
+    rng = np.random.default_rng(seed)
+    n_iterations = len(params['k'])
+    per_iteration = max(1, int(np.ceil(samples / n_iterations)))
+    s_a = spec['component_cols'][:, spec['components'].index('additive_terms')]
+    s_m = spec['component_cols'][:, spec['components'].index('multiplicative_terms')]
+
+    yhat_samples, trend_samples = [], []
+    for i in range(n_iterations):
+        expected = predict_trend(spec, t, params['k'][i], params['m'][i], params['delta'][i])
+        trends = expected + sample_trend_uncertainty(spec, t, params['delta'][i], per_iteration, rng) * spec['y_scale']
+        Xb_a = X @ (params['beta'][i] * s_a) * spec['y_scale']
+        Xb_m = X @ (params['beta'][i] * s_m)
+        noise = rng.normal(0, params['sigma_obs'][i], trends.shape) * spec['y_scale']
+        yhat_samples.append(trends * (1 + Xb_m) + Xb_a + noise)
+        trend_samples.append(trends)
+
+    lower_p, upper_p = interval_percentiles(spec)
+    yhat_bounds = np.percentile(np.vstack(yhat_samples), [lower_p, upper_p], axis=0)
+    trend_bounds = np.percentile(np.vstack(trend_samples), [lower_p, upper_p], axis=0)
+    return {
+        'yhat_lower': yhat_bounds[0],
+        'yhat_upper': yhat_bounds[1],
+        'trend_lower': trend_bounds[0],
+        'trend_upper': trend_bounds[1],
+    }
+
+
+# Prévisions ponctuelles (yhat) de plusieurs scénarios de régresseurs en une seule passe.
+# Chaque scénario s remplace la valeur v de chaque régresseur j par v * scales[s, j] + shifts[s, j]
+# ('scales' et 'shifts' : tableaux (nombre de scénarios, nombre de régresseurs) dans l'ordre de
+# spec['regressors']). La matrice des variables explicatives n'est construite qu'une fois, pour les
+# régresseurs de référence : les régresseurs entrant linéairement dans yhat, l'effet des scénarios
+# s'obtient par un seul produit matriciel. Retourne (yhat de référence (dates,), yhat (dates, scénarios)).
+def predict_scenarios(spec, dates, regressors, scales, shifts):
+    params = spec['params']
+    t = (dates.astype('datetime64[ns]').astype(np.int64) - spec['start']) / spec['t_scale']
+    trend = predict_trend(
+        spec, t, np.nanmean(params['k']), np.nanmean(params['m']), np.nanmean(params['delta'], axis=0)
+    )
+    X = design_matrix(spec, dates, regressors)
+    beta = np.nanmean(params['beta'], axis=0)
+    s_a = spec['component_cols'][:, spec['components'].index('additive_terms')]
+    s_m = spec['component_cols'][:, spec['components'].index('multiplicative_terms')]
+    additive = X @ (beta * s_a) * spec['y_scale']
+    multiplicative = X @ (beta * s_m)
+    base = trend * (1 + multiplicative) + additive
+
+    # Effet d'un écart de régresseurs (v * (scale - 1) + shift) / std sur les termes additifs et multiplicatifs
+    n = len(spec['regressors'])
+    if n == 0:
+        return base, np.repeat(base[:, None], len(scales), axis=1)
+    values = np.asarray(regressors, dtype=float)
+    scales = np.asarray(scales, dtype=float).reshape(-1, n)
+    shifts = np.asarray(shifts, dtype=float).reshape(-1, n)
+    weights = beta[-n:] / spec['regressor_std']
+    w_a = weights * s_a[-n:] * spec['y_scale']
+    w_m = weights * s_m[-n:]
+    delta_a = (values * w_a) @ (scales - 1).T + shifts @ w_a
+    delta_m = (values * w_m) @ (scales - 1).T + shifts @ w_m
+    return base, trend[:, None] * (1 + multiplicative[:, None] + delta_m) + additive[:, None] + delta_a
+
+
+# Empilement de plusieurs modèles pour les évaluer ensemble (voir predict_stacked).
+# Les séries partagent une base de variables : séries de Fourier de chaque période jusqu'à l'ordre le plus
+# élevé parmi les modèles (les ordres inférieurs en sont les premières colonnes) et indicatrices de tous
+# leurs jours fériés ; les régresseurs, standardisés différemment pour chaque modèle, sont propres à chaque
+# série. Les coefficients de toutes les composantes de tous les modèles sont rangés dans une seule matrice
+# (variables de la base et régresseurs, composantes de chaque modèle), nulle là où un modèle n'utilise pas
+# une variable.
+def stack_specs(specs):
+    periods, holidays = {}, {}
+    for spec in specs:
+        for seasonality in spec['seasonalities']:
+            period = seasonality['period']
+            periods[period] = max(periods.get(period, 0), seasonality['fourier_order'])
+        for key, days in zip(spec['holiday_features'], spec['holiday_days']):
+            holidays.setdefault((key, days.tobytes()), days)
+    basis = {
+        'seasonalities': [{'name': str(period), 'period': period, 'fourier_order': order}
+                          for period, order in periods.items()],
+        'holiday_features': [key for key, _ in holidays],
+        'holiday_days': list(holidays.values()),
+        'holiday_key': feature_cache.holiday_key([key for key, _ in holidays], list(holidays.values())),
+        'regressors': [],
+    }
+
+    # Colonne de la base de chaque variable de saisonnalité (période, ordre, sinus ou cosinus) et de chaque jour férié
+    columns, offset = {}, 0
+    for period, order in periods.items():
+        for n in range(order):
+            columns[(period, n, 0)] = offset + 2 * n
+            columns[(period, n, 1)] = offset + 2 * n + 1
+        offset += 2 * order
+    for j, holiday in enumerate(holidays):
+        columns[holiday] = offset + j
+    n_basis = offset + len(holidays)
+
+    n_rows = n_basis + sum(len(spec['regressors']) for spec in specs)
+    weights = np.zeros((n_rows, sum(len(spec['components']) for spec in specs)))
+    row, col, slices = n_basis, 0, []
+    for spec in specs:
+        rows = [columns[(seasonality['period'], n, k)]
+                for seasonality in spec['seasonalities'] for n in range(seasonality['fourier_order']) for k in (0, 1)]
+        rows += [columns[(key, days.tobytes())] for key, days in zip(spec['holiday_features'], spec['holiday_days'])]
+        rows += list(range(row, row + len(spec['regressors'])))
+        row += len(spec['regressors'])
+
+        scale = np.where(np.isin(spec['components'], spec['additive_components']), spec['y_scale'], 1.)
+        beta = np.nanmean(spec['params']['beta'], axis=0)
+        n_components = len(spec['components'])
+        weights[rows, col:col + n_components] = beta[:, None] * spec['component_cols'] * scale
+        slices.append(slice(col, col + n_components))
+        col += n_components
+
+    # Tendances : points de changement complétés par +inf (jamais atteints) jusqu'au plus grand nombre
+    n_changepoints = max(len(spec['changepoints_t']) for spec in specs)
+    changepoints_t = np.full((len(specs), n_changepoints), np.inf)
+    deltas = np.zeros((len(specs), n_changepoints))
+    offsets = np.zeros((len(specs), n_changepoints))
+    for s, spec in enumerate(specs):
+        n = len(spec['changepoints_t'])
+        changepoints_t[s, :n] = spec['changepoints_t']
+        deltas[s, :n] = np.nanmean(spec['params']['delta'], axis=0)
+        offsets[s, :n] = -deltas[s, :n] * spec['changepoints_t']
+    return {
+        'specs': specs,
+        'basis': basis,
+        'weights': weights,
+        'slices': slices,
+        'flat': np.array([spec['growth'] == 'flat' for spec in specs]),
+        'start': np.array([spec['start'] for spec in specs], dtype=float),
+        't_scale': np.array([spec['t_scale'] for spec in specs], dtype=float),
+        'y_scale': np.array([spec['y_scale'] for spec in specs]),
+        'k': np.array([np.nanmean(spec['params']['k']) for spec in specs]),
+        'm': np.array([np.nanmean(spec['params']['m']) for spec in specs]),
+        'changepoints_t': changepoints_t,
+        'deltas': deltas,
+        'offsets': offsets,
+    }
+
+
+# Prévisions ponctuelles de tous les modèles empilés par stack_specs(), en une passe : tendances de toutes
+# les séries calculées ensemble, puis toutes les composantes par un seul produit matriciel entre la base
+# commune suivie des régresseurs de chaque série et la matrice des coefficients.
+# 'regressors' : tableaux des régresseurs de chaque modèle, comme pour predict() ; 'components' limite
+# le calcul à certaines composantes (seules les colonnes correspondantes des coefficients sont utilisées).
+# Retourne une prévision par modèle, avec les colonnes de predict(samples=0, components=components).
+def predict_stacked(stacked, dates, regressors, components=None):
+    ns = dates.astype('datetime64[ns]').astype(np.int64)
+    t = (ns[:, None] - stacked['start']) / stacked['t_scale']
+    active = stacked['changepoints_t'][None, :, :] <= t[:, :, None]
+    k_t = stacked['k'] + (active * stacked['deltas']).sum(axis=2)
+    m_t = stacked['m'] + (active * stacked['offsets']).sum(axis=2)
+    trend = np.where(stacked['flat'], stacked['m'], k_t * t + m_t) * stacked['y_scale']
+
+    blocks = [design_matrix(stacked['basis'], dates, None)]
+    for spec, values in zip(stacked['specs'], regressors):
+        if spec['regressors']:
+            values = np.asarray(values, dtype=float)
+            if np.isnan(values).any():
+                raise ValueError("Valeurs de régresseurs manquantes sur la période demandée")
+            blocks.append((values - spec['regressor_mu']) / spec['regressor_std'])
+
+    # Colonnes des coefficients des composantes demandées de chaque modèle
+    names, selected = [], []
+    for spec, columns in zip(stacked['specs'], stacked['slices']):
+        if components is None:
+            selected.append(np.arange(columns.start, columns.stop))
+        else:
+            wanted = set(components) | {'additive_terms', 'multiplicative_terms'}
+            selected.append(np.array([columns.start + j for j, c in enumerate(spec['components']) if c in wanted]))
+        names.append([spec['components'][j - columns.start] for j in selected[-1]])
+    values = np.hstack(blocks) @ stacked['weights'][:, np.concatenate(selected)]
+
+    forecasts, first = [], 0
+    for s, columns in enumerate(names):
+        block = values[:, first:first + len(columns)]
+        first += len(columns)
+        yhat = (trend[:, s] * (1 + block[:, columns.index('multiplicative_terms')])
+                + block[:, columns.index('additive_terms')])
+        forecast = pd.DataFrame(np.column_stack((trend[:, s], block, yhat)), columns=['trend', *columns, 'yhat'])
+        forecast.insert(0, 'ds', dates)
+        forecasts.append(forecast)
+    return forecasts
+
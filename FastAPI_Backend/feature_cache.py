@@ -0,0 +1,201 @@
+# Cache des variables de saisonnalité et de jours fériés
+#
+# Les séries de Fourier et les indicatrices des jours fériés ne dépendent que des dates : elles sont
+# construites une fois sur une grille journalière et gardées en mémoire, avec pour clé la période de la
+# saisonnalité ou l'ensemble de jours fériés. La grille d'une clé s'étend à l'union des plages de dates
+# demandées et une saisonnalité est calculée jusqu'à l'ordre le plus élevé demandé. Les variables d'une
+# grille de dates (historique et horizon, fenêtre, tronçon) sont alors des lignes de la grille, et celles
+# d'un ordre inférieur ses premières colonnes : elles sont partagées entre modèles, horizons et requêtes.
+#
+# Utilisé par le moteur NumPy (fast_engine.design_matrix) et, via install(), par Prophet.predict.
+# Les dates qui ne tombent pas à minuit sont calculées sans passer par le cache.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_DAY = 86400 * 10**9
+
+# Nombre maximal de blocs de variables gardés en mémoire
+FEATURE_CACHE_ENTRIES = int(os.environ.get('FEATURE_CACHE_ENTRIES', 64))
+
+
+# Indices des jours (depuis le 1er janvier 1970) des dates, ou None si une date ne tombe pas à minuit
+def whole_days(dates):
+    ns = np.asarray(dates).astype('datetime64[ns]').astype(np.int64)
+    if (ns % NANOSECONDS_PER_DAY).any():
+        return None
+    return ns // NANOSECONDS_PER_DAY
+
+
+# Séries de Fourier d'ordre 'order' pour des jours donnés, avec les mêmes opérations que Prophet.fourier_series
+def fourier_series(days, period, order):
+    x_T = np.asarray(days, dtype=float) * np.pi * 2
+    features = np.empty((len(x_T), 2 * order))
+    for i in range(order):
+        c = x_T * (i + 1) / period
+        features[:, 2 * i] = np.sin(c)
+        features[:, 2 * i + 1] = np.cos(c)
+    return features
+
+
+# Indicatrices des jours fériés pour des jours donnés : 'holiday_days' contient, pour chaque colonne,
+# les jours où elle vaut 1 ; un seul test d'appartenance des couples (jour, colonne)
+def holiday_indicators(days, holiday_days):
+    n_holidays = len(holiday_days)
+    if n_holidays == 0:
+        return np.empty((len(days), 0))
+    codes = np.concatenate([np.asarray(d, dtype=np.int64) * n_holidays + j for j, d in enumerate(holiday_days)])
+    return np.isin(np.asarray(days)[:, None] * n_holidays + np.arange(n_holidays), codes).astype(float)
+
+
+# Clé d'un ensemble de jours fériés (noms des colonnes et jours de chacune)
+def holiday_key(features, holiday_days):
+    digest = hashlib.sha1()
+    for key, days in zip(features, holiday_days):
+        digest.update(key.encode())
+        digest.update(np.asarray(days, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+# Cache LRU borné des blocs de variables : clé -> (premier jour de la grille, matrice en lecture seule)
+class FeatureCache:
+    def __init__(self, max_entries=FEATURE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Lignes du bloc 'key' pour les jours 'days'. 'build(days, width)' construit le bloc pour des jours
+    # donnés ; 'width' est le nombre de colonnes voulu pour un bloc dont la largeur varie (saisonnalités),
+    # None sinon. Le résultat est une vue en lecture seule quand les jours sont consécutifs.
+    def rows(self, key, days, build, width=None):
+        if len(days) == 0 or self.max_entries <= 0:
+            return build(days, width)
+        first, last = int(days.min()), int(days.max())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            covered = (entry is not None and entry[0] <= first and last < entry[0] + len(entry[1])
+                       and (width is None or entry[1].shape[1] >= width))
+            if covered:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not covered:
+            # Nouvelle grille couvrant la grille actuelle et les jours demandés
+            size = width
+            if entry is not None:
+                first, last = min(first, entry[0]), max(last, entry[0] + len(entry[1]) - 1)
+                if width is not None:
+                    size = max(width, entry[1].shape[1])
+            matrix = build(np.arange(first, last + 1), size)
+            matrix.flags.writeable = False
+            entry = (first, matrix)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        start, matrix = entry
+        index = days - start
+        if index[-1] - index[0] == len(index) - 1 and (np.diff(index) == 1).all():
+            block = matrix[index[0]:index[-1] + 1]
+        else:
+            block = matrix[index]
+        return block if width is None else block[:, :width]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = FeatureCache()
+
+
+# Séries de Fourier d'une saisonnalité (colonnes sin, cos de chaque ordre, comme dans Prophet)
+def seasonality_features(dates, period, order):
+    days = whole_days(dates)
+    if days is None:
+        ns = np.asarray(dates).astype('datetime64[ns]').astype(np.int64)
+        return fourier_series(ns // 10**9 / 86400., period, order)
+    return cache.rows(('fourier', float(period)), days,
+                      lambda grid, width: fourier_series(grid, period, width // 2), 2 * order)
+
+
+# Indicatrices des jours fériés 'features' (jours de chaque colonne dans 'holiday_days') ;
+# 'key' : clé de l'ensemble (holiday_key), calculée si elle n'est pas fournie
+def holiday_features(dates, features, holiday_days, key=None):
+    days = whole_days(dates)
+    if days is None:
+        ns = np.asarray(dates).astype('datetime64[ns]').astype(np.int64)
+        return holiday_indicators(ns // NANOSECONDS_PER_DAY, holiday_days)
+    if key is None:
+        key = holiday_key(features, holiday_days)
+    return cache.rows(('holidays', key), days, lambda grid, width: holiday_indicators(grid, holiday_days))
+
+
+# Variables de jours fériés de Prophet en cache : colonnes, a priori et noms renvoyés par
+# Prophet.make_holiday_features pour chaque ensemble de jours fériés déjà rencontré
+_prophet_holidays = {}
+
+# Correspondance variables -> composantes de Prophet (Prophet.regressor_column_matrix, un tableau croisé
+# recalculé à chaque prévision) pour chaque ensemble de variables et de modes déjà rencontré
+_component_cols = {}
+
+
+# Remplace, sur un modèle Prophet (une copie, voir forecasting.compute_forecast), la construction des
+# variables de saisonnalité et de jours fériés par leur lecture dans le cache, et celle de la
+# correspondance entre variables et composantes par sa version mémorisée ; les résultats sont ceux de
+# Prophet.make_seasonality_features, Prophet.make_holiday_features et Prophet.regressor_column_matrix
+def install(model):
+    make_holiday_features = model.make_holiday_features
+    regressor_column_matrix = model.regressor_column_matrix
+
+    def seasonality(dates, period, series_order, prefix):
+        features = np.array(seasonality_features(dates.values, period, series_order))
+        columns = [f'{prefix}_delim_{i + 1}' for i in range(features.shape[1])]
+        return pd.DataFrame(features, columns=columns)
+
+    def holidays(dates, frame):
+        content = pd.util.hash_pandas_object(frame, index=False).values.tobytes()
+        key = ('prophet', hashlib.sha1(content).hexdigest(), float(model.holidays_prior_scale))
+        if key not in _prophet_holidays:
+            sample, prior_scales, names = make_holiday_features(pd.Series(dates.values[:1]), frame)
+            _prophet_holidays[key] = (list(sample.columns), prior_scales, names)
+        columns, prior_scales, names = _prophet_holidays[key]
+
+        def build(grid, width):
+            grid_dates = pd.Series(grid * NANOSECONDS_PER_DAY).astype('datetime64[ns]')
+            return make_holiday_features(grid_dates, frame)[0][columns].values
+
+        days = whole_days(dates.values)
+        if days is None:
+            return make_holiday_features(dates, frame)
+        features = np.array(cache.rows(('holidays', key), days, build))
+        return pd.DataFrame(features, columns=columns), list(prior_scales), list(names)
+
+    def column_matrix(seasonal_features, modes):
+        holiday_names = None if model.train_holiday_names is None else tuple(model.train_holiday_names)
+        key = (tuple(seasonal_features.columns), tuple((mode, tuple(names)) for mode, names in modes.items()),
+               holiday_names)
+        if key not in _component_cols:
+            _component_cols[key] = regressor_column_matrix(
+                seasonal_features, {mode: list(names) for mode, names in modes.items()})
+        component_cols, component_modes = _component_cols[key]
+        return component_cols.copy(), {mode: list(names) for mode, names in component_modes.items()}
+
+    model.make_seasonality_features = seasonality
+    model.make_holiday_features = holidays
+    model.regressor_column_matrix = column_matrix
+    return model
@@ -0,0 +1,96 @@
+# Cache des prévisions Prophet et empreintes des artefacts (modèles et régresseurs)
+
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Mémo des empreintes déjà calculées : chemin -> ((mtime_ns, taille), sha256)
+_file_hashes = {}
+
+# Fonction pour calculer l'empreinte SHA-256 du contenu d'un fichier
+# (le hachage n'est recalculé que si la date de modification ou la taille du fichier changent)
+def file_hash(path):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    known = _file_hashes.get(path)
+    if known is not None and known[0] == signature:
+        return known[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _file_hashes[path] = (signature, digest.hexdigest())
+    return digest.hexdigest()
+
+
+# Cache LRU borné des prévisions.
+# Les clés sont des tuples dont le premier élément est le nom du modèle,
+# ce qui permet d'invalider toutes les entrées d'un modèle d'un seul coup.
+class ForecastCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            # Éviction des entrées les moins récemment utilisées
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Supprime les entrées d'un modèle (ou toutes si model_name est None)
+    # et retourne le nombre d'entrées supprimées
+    def invalidate(self, model_name=None):
+        with self._lock:
+            if model_name is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            keys = [key for key in self._entries if key[0] == model_name]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+
+# Regroupement des calculs identiques simultanés : le premier appel pour une clé lance le calcul,
+# les appels suivants pour la même clé, tant qu'il est en cours, attendent le même résultat (ou la
+# même erreur). L'annulation d'un appel (client déconnecté) n'interrompt pas le calcul partagé.
+class SingleFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    # 'compute' : fonction sans argument retournant la coroutine du calcul
+    async def run(self, key, compute):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,223 @@
+# Calcul des prévisions Prophet
+#
+# Ce module contient l'état nécessaire aux calculs (registre des modèles, régresseurs en mémoire)
+# et les fonctions exécutées dans les processus du pool de calcul de l'API : chaque processus
+# charge les modèles à précharger via init_worker(), puis compute_forecast() y est appelée.
+
+import copy
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import fast_engine
+import feature_cache
+from departments import DEPARTMENTS_DIR
+from model_registry import ModelRegistry
+from regressor_store import RegressorStore
+
+# Registre des modèles servis (manifeste models/manifest.json), gardés en mémoire
+# dans la limite de MODEL_MEMORY_MB Mo (0 : sans limite)
+registry = ModelRegistry('models', max_bytes=int(float(os.environ.get('MODEL_MEMORY_MB', 512)) * 2**20))
+
+# Modèles départementaux (magasin models/departments/, voir departments.py), tous chargés à leur première
+# utilisation et gardés en mémoire dans la limite de DEPARTMENT_MEMORY_MB Mo
+departments = ModelRegistry(DEPARTMENTS_DIR,
+                            max_bytes=int(float(os.environ.get('DEPARTMENT_MEMORY_MB', 256)) * 2**20))
+
+# Régresseurs lus une fois et gardés en mémoire
+regressor_store = RegressorStore('data')
+
+# Registre d'un modèle : celui des modèles nationaux, à défaut celui des modèles départementaux
+def registry_of(model_name):
+    return registry if model_name in registry else departments
+
+# Régresseurs d'un modèle, indexés par 'ds' (None pour un modèle sans régresseurs)
+def model_regressors(model_name):
+    variable = registry_of(model_name).regressors(model_name)
+    return None if variable is None else regressor_store.get(variable)
+
+# Version des régresseurs d'un modèle
+def regressors_version(model_name):
+    variable = registry_of(model_name).regressors(model_name)
+    return None if variable is None else regressor_store.version(variable)
+
+# Valeurs des régresseurs d'un modèle ('regressors', voir model_regressors) aux dates données,
+# dans l'ordre de spec['regressors']
+def regressor_values(regressors, spec, dates):
+    if regressors is None:
+        return np.empty((len(dates), 0))
+    return regressors.reindex(dates)[spec['regressors']].values
+
+# Contexte des pools de processus créés par l'API (calcul des prévisions, backtests) : 'forkserver',
+# à défaut 'spawn'. Le processus de l'API a des threads (exécuteur par défaut, tâches, chargements) : un
+# fork pourrait copier dans le nouveau processus un verrou tenu par l'un d'eux, qui ne serait jamais libéré.
+# Les processus sont créés par le serveur de fork, sans threads, qui a déjà importé ce module (et Prophet).
+def process_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['forecasting', 'backtesting'])
+    return context
+
+# Initialisation d'un processus de calcul : chargement des modèles à précharger et de leurs régresseurs
+# (depuis leur version binaire, projetée en mémoire : les pages sont partagées avec les autres processus ;
+# les autres modèles sont chargés à leur première utilisation)
+def init_worker():
+    model_names = registry.preloaded()
+    for model_name in model_names:
+        registry.refresh(model_name)
+    regressor_store.load_all({registry.regressors(model_name) for model_name in model_names} - {None})
+
+# Prédiction de contrôle d'une nouvelle version d'un modèle (entrée chargée avec registry.load())
+# avant sa mise en service : échoue si le modèle ou ses régresseurs sont inutilisables
+def warm_up(model_name, entry):
+    model = copy.copy(entry['model'])
+    model.uncertainty_samples = 0
+    regressors = model_regressors(model_name)
+    future = model.make_future_dataframe(periods=1, freq='D')
+    if regressors is not None:
+        future = future.join(regressors, on='ds')
+    forecast = model.predict(future)
+    if entry['spec'] is not None:
+        spec = entry['spec']
+        dates = future['ds'].values
+        forecast = fast_engine.predict(spec, dates, regressor_values(regressors, spec, dates))
+    if not np.isfinite(forecast['yhat'].values).all():
+        raise ValueError(f"Prévision de contrôle invalide pour le modèle {model_name}")
+
+# Grille de dates commune à plusieurs modèles (chargés) : leur historique, s'il est identique pour tous,
+# suivi de 'horizon' jours (None si les historiques diffèrent)
+def shared_future_dates(models, horizon):
+    if any(not model.history_dates.equals(models[0].history_dates) for model in models[1:]):
+        return None
+    return models[0].make_future_dataframe(periods=horizon, freq='D')['ds'].values
+
+# Calcul de la prévision d'un modèle sur 'horizon' jours (historique inclus)
+# avec Prophet ('prophet') ou avec le moteur NumPy ('fast').
+# Les intervalles d'incertitude sont estimés sur 'samples' simulations tirées avec la graine 'seed'
+# (samples = 0 : pas d'intervalles, seulement les valeurs prédites).
+# 'dates' permet de fournir une grille déjà construite (par exemple par shared_future_dates()),
+# 'components' de limiter les composantes calculées par le moteur NumPy
+# et 'timings' de recueillir la durée des étapes du calcul.
+def compute_forecast(model_name, horizon, engine='prophet', samples=1000, seed=0, dates=None, components=None,
+                     timings=None):
+    # Durée de chaque étape, ajoutée à 'timings' s'il est fourni
+    timings = {} if timings is None else timings
+    clock = time.perf_counter()
+
+    def lap(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - clock
+        clock = now
+
+    entry = registry_of(model_name).refresh(model_name)
+    lap('model')
+
+    # Régresseurs déjà en mémoire, indexés par 'ds'
+    regressors = model_regressors(model_name)
+    lap('regressors')
+
+    if engine == 'fast':
+        spec = entry['spec']
+        if dates is None:
+            dates = fast_engine.make_future_dates(spec, horizon)
+        lap('future')
+        values = regressor_values(regressors, spec, dates)
+        lap('join')
+        forecast = fast_engine.predict(spec, dates, values, samples=samples, seed=seed, components=components)
+        lap('predict')
+        return forecast
+
+    # Copie légère du modèle pour fixer le nombre de simulations sans modifier le modèle partagé,
+    # avec les variables de saisonnalité et de jours fériés lues dans le cache partagé
+    model = feature_cache.install(copy.copy(entry['model']))
+    model.uncertainty_samples = samples
+
+    # Création du DataFrame future
+    if dates is None:
+        future = model.make_future_dataframe(periods=horizon, freq='D', include_history=True)
+    else:
+        future = pd.DataFrame({'ds': dates})
+    lap('future')
+
+    # Ajout des régresseurs à future par jointure sur l'index 'ds'
+    if regressors is not None:
+        future = future.join(regressors, on='ds')
+    lap('join')
+
+    # Effectuer la prédiction (Prophet tire ses simulations avec le générateur global de NumPy)
+    np.random.seed(seed)
+    forecast = model.predict(future)
+    lap('predict')
+    return forecast
+
+# Calcul de scénarios de régresseurs avec le moteur NumPy (voir fast_engine.predict_scenarios) sur les dates
+# 'dates' : 'overrides' est une liste de couples ({régresseur: facteur}, {régresseur: décalage}).
+# Retourne (yhat de référence, yhat de chaque scénario en colonnes).
+def compute_scenarios(model_name, dates, overrides):
+    spec = registry_of(model_name).spec(model_name)
+    values = regressor_values(model_regressors(model_name), spec, dates)
+    index = {regressor: j for j, regressor in enumerate(spec['regressors'])}
+    scales = np.ones((len(overrides), len(index)))
+    shifts = np.zeros((len(overrides), len(index)))
+    for s, (scale, shift) in enumerate(overrides):
+        for regressor, value in scale.items():
+            scales[s, index[regressor]] = value
+        for regressor, value in shift.items():
+            shifts[s, index[regressor]] = value
+    return fast_engine.predict_scenarios(spec, dates, values, scales, shifts)
+
+# Modèles empilés pour le moteur NumPy (voir fast_engine.stack_specs), par liste de modèles,
+# avec les versions des modèles à partir desquelles ils ont été empilés
+stacked_specs = {}
+
+# Modèles empilés d'une liste de modèles, empilés à nouveau si l'un d'eux a changé de version
+def stacked_spec(model_names):
+    key = tuple(model_names)
+    versions = tuple(registry_of(model_name).version(model_name) for model_name in model_names)
+    entry = stacked_specs.get(key)
+    if entry is None or entry[0] != versions:
+        if len(stacked_specs) >= 16:
+            stacked_specs.clear()
+        entry = (versions, fast_engine.stack_specs([registry_of(model_name).spec(model_name) for model_name in model_names]))
+        stacked_specs[key] = entry
+    return entry[1]
+
+# Prévisions ponctuelles de plusieurs modèles sur les mêmes dates, calculées ensemble par le moteur NumPy
+# (voir fast_engine.predict_stacked) ; 'components' et 'timings' comme pour compute_forecast()
+def compute_stacked(model_names, dates, components=None, timings=None):
+    timings = {} if timings is None else timings
+    clock = time.perf_counter()
+
+    def lap(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - clock
+        clock = now
+
+    stacked = stacked_spec(model_names)
+    lap('model')
+    regressors = [model_regressors(model_name) for model_name in model_names]
+    lap('regressors')
+    values = [regressor_values(table, spec, dates) for table, spec in zip(regressors, stacked['specs'])]
+    lap('join')
+    forecasts = fast_engine.predict_stacked(stacked, dates, values, components)
+    lap('predict')
+    return forecasts
+
+# Prévisions empilées (voir compute_stacked) avec la durée de chacune des étapes du calcul
+def timed_stacked(*args, **kwargs):
+    timings = {}
+    forecasts = compute_stacked(*args, timings=timings, **kwargs)
+    return forecasts, timings
+
+# Calcul d'une prévision (voir compute_forecast) avec la durée de chacune de ses étapes,
+# retournées avec la prévision pour être enregistrées par le processus principal
+def timed_forecast(*args, **kwargs):
+    timings = {}
+    forecast = compute_forecast(*args, timings=timings, **kwargs)
+    return forecast, timings
@@ -0,0 +1,63 @@
+# Configuration de gunicorn pour servir l'API en production (voir le Dockerfile)
+#
+# Le processus maître importe l'application (preload_app), charge les modèles à précharger et calcule
+# leurs prévisions avant de créer les workers uvicorn : ceux-ci héritent des modèles et des prévisions
+# par copie à l'écriture au lieu de les recharger et de les recalculer chacun. Chaque worker calcule
+# ses prévisions dans un thread (PREDICTION_WORKERS=0 par défaut), le parallélisme venant du nombre
+# de workers, fixé par défaut au nombre de cœurs.
+# Les métriques de chaque worker sont écrites dans METRICS_MULTIPROC_DIR (par défaut un dossier temporaire
+# créé au lancement) et agrégées par la route /metrics, quel que soit le worker qui la sert (voir metrics.py).
+# Redémarrage progressif des workers : kill -HUP <pid du maître>.
+
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# Les workers calculent les prévisions eux-mêmes plutôt que de démarrer chacun un pool de processus
+os.environ.setdefault('PREDICTION_WORKERS', '0')
+
+# Dossier des métriques des workers, défini avant l'import de l'application
+os.environ.setdefault('METRICS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='prophet_api_metrics_'))
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+
+# Délais (en secondes) : calcul le plus long toléré, et fin des requêtes en cours lors d'un redémarrage
+timeout = int(os.environ.get('WORKER_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+
+# Recyclage optionnel des workers après un nombre de requêtes (0 : jamais)
+max_requests = int(os.environ.get('MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+
+# Métriques d'un lancement précédent retirées (dossier METRICS_MULTIPROC_DIR fourni et réutilisé)
+def on_starting(server):
+    os.makedirs(os.environ['METRICS_MULTIPROC_DIR'], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ['METRICS_MULTIPROC_DIR'], '*.json')):
+        os.remove(path)
+
+
+# Chargement des modèles et calcul de leurs prévisions dans le processus maître, une fois l'application
+# importée et avant la création des workers ; gc.freeze() évite que le ramasse-miettes ne touche
+# (et donc ne copie) leurs pages
+def when_ready(server):
+    import forecasting
+    import prophet_api
+
+    forecasting.registry.convert_all()
+    forecasting.init_worker()
+    prophet_api.precompute_forecasts()
+    gc.freeze()
+    server.log.info("Modèles préchargés : %s", ', '.join(forecasting.registry.preloaded()))
+
+
+# Métriques d'un worker terminé : ses compteurs restent comptés, ses jauges ne sont plus rendues
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
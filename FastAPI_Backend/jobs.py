@@ -0,0 +1,125 @@
+# Tâches de calcul asynchrones (prévisions groupées, scénarios, backtests...)
+#
+# Une tâche est soumise avec submit() : elle reçoit un identifiant, est placée dans une file locale
+# et exécutée par l'un des exécutants de la boucle asyncio de l'API. Son état (queued, running, done,
+# failed), sa progression et son résultat sont enregistrés sur le disque, dans {dossier}/{identifiant}/ :
+# ils restent lisibles par tous les workers de l'API et après un redémarrage.
+#
+# Une tâche est une coroutine run(progress) qui retourne (contenu, type MIME) ; elle signale
+# son avancement en appelant progress(fraction, message).
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+
+STATUS_FILE = 'status.json'
+RESULT_FILE = 'result'
+
+# États d'une tâche terminée
+FINISHED = ('done', 'failed')
+
+
+# Vrai si le processus 'pid' (celui qui exécute une tâche) est toujours en vie
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return pid != os.getpid()
+
+
+class JobManager:
+    def __init__(self, directory='jobs', workers=1, ttl=86400):
+        self.directory = directory
+        self.workers = workers
+        self.ttl = ttl
+        self._queue = None
+        self._tasks = []
+
+    def _path(self, job_id, name=STATUS_FILE):
+        return os.path.join(self.directory, job_id, name)
+
+    # Écriture atomique de l'état d'une tâche
+    def _write(self, status):
+        path = self._path(status['id'])
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(status, f)
+        os.replace(f"{path}.tmp", path)
+
+    # Démarrage des exécutants ; les tâches laissées inachevées par un processus arrêté sont marquées en échec
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for job_id in os.listdir(self.directory):
+            status = self.status(job_id)
+            if status is not None and status['status'] not in FINISHED and not _alive(status['pid']):
+                self.update(job_id, status='failed', error="Tâche interrompue par un arrêt de l'API",
+                            finished=time.time())
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    # État d'une tâche (None si elle n'existe pas)
+    def status(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **changes):
+        status = self.status(job_id)
+        status.update(changes)
+        self._write(status)
+        return status
+
+    def result_path(self, job_id):
+        return self._path(job_id, RESULT_FILE)
+
+    # Soumission d'une tâche ('kind' : type de tâche, 'params' : paramètres conservés dans son état)
+    def submit(self, kind, run, params=None):
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.directory, job_id))
+        status = {
+            'id': job_id, 'kind': kind, 'params': params, 'status': 'queued', 'progress': 0.0, 'message': None,
+            'error': None, 'media_type': None, 'created': time.time(), 'started': None, 'finished': None,
+            'pid': os.getpid(),
+        }
+        self._write(status)
+        self._queue.put_nowait((job_id, run))
+        return status
+
+    async def _worker(self):
+        while True:
+            job_id, run = await self._queue.get()
+            self.update(job_id, status='running', started=time.time())
+
+            def progress(fraction, message=None):
+                self.update(job_id, progress=round(fraction, 4), message=message)
+
+            try:
+                body, media_type = await run(progress)
+                with open(self.result_path(job_id), 'wb') as f:
+                    f.write(body.encode() if isinstance(body, str) else body)
+                self.update(job_id, status='done', progress=1.0, media_type=media_type, finished=time.time())
+            except Exception as error:
+                self.update(job_id, status='failed', error=getattr(error, 'detail', None) or str(error),
+                            finished=time.time())
+
+    # Suppression des tâches terminées depuis plus de 'ttl' secondes
+    def cleanup(self):
+        limit = time.time() - self.ttl
+        for job_id in os.listdir(self.directory):
+            status = self.status(job_id)
+            if status is not None and status['status'] in FINISHED and status['finished'] < limit:
+                shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
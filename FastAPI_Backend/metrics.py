@@ -0,0 +1,291 @@
+# Métriques de l'API au format texte de Prometheus (route /metrics)
+#
+# Compteurs, jauges et histogrammes minimaux, enregistrés dans REGISTRY et rendus par render().
+# Les durées des étapes calculées dans les processus du pool de calcul sont renvoyées avec
+# la prévision (voir forecasting.timed_forecast) et enregistrées dans le processus principal.
+#
+# Avec plusieurs processus serveurs (workers gunicorn, voir gunicorn.conf.py), chacun a ses métriques :
+# si METRICS_MULTIPROC_DIR est défini, chaque processus écrit les siennes dans {dossier}/{pid}.json
+# (write_snapshot(), appelée régulièrement et avant chaque rendu) et render() agrège celles de tous les
+# processus, comme le mode multiprocessus du client Prometheus : compteurs et histogrammes sont sommés,
+# y compris ceux des processus terminés (mark_process_dead()), pour ne jamais décroître ; les jauges,
+# propres à chaque processus, sont rendues par processus vivant avec un libellé 'pid'.
+
+from contextlib import contextmanager
+import glob
+import json
+import os
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Bornes (en secondes) des histogrammes de durée
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Métriques enregistrées, dans leur ordre de création
+REGISTRY = []
+
+# Dossier des métriques des processus serveurs (None : un seul processus)
+MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR') or None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _samples(self, values=None):
+        if values is None:
+            values = self.values()
+        return [(self.name, self._labels(key), value) for key, value in values.items()]
+
+    # Copie des valeurs par libellés
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    # Valeurs de plusieurs processus ({pid: valeurs}, voir merge) réunies en une seule série
+    def merge(self, values):
+        merged = {}
+        for process_values in values.values():
+            for key, value in process_values.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples(values)]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    # Valeur d'un compteur tenu par ailleurs (par exemple les compteurs du cache des prévisions)
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    # Une série par processus vivant, distinguée par le libellé 'pid'
+    def merge(self, values):
+        return {(*key, pid): value for pid, process_values in values.items() for key, value in process_values.items()}
+
+    def _labels(self, key, extra=()):
+        if len(key) > len(self.labelnames):
+            key, extra = key[:-1], [('pid', key[-1]), *extra]
+        return super()._labels(key, extra)
+
+    # Jauge augmentée le temps d'un bloc (opérations en cours)
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    # Durée d'un bloc
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def values(self):
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    def merge(self, values):
+        merged = {}
+        for process_values in values.values():
+            for key, (counts, total) in process_values.items():
+                merged_counts, merged_total = merged.get(key, ([0] * len(self.buckets), 0.0))
+                merged[key] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+        return merged
+
+    def _samples(self, values=None):
+        if values is None:
+            values = self.values()
+        samples = []
+        for key, (counts, total) in values.items():
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", self._labels(key, [('le', _format_value(bound))]), count))
+            samples.append((f"{self.name}_sum", self._labels(key), total))
+            samples.append((f"{self.name}_count", self._labels(key), counts[-1]))
+        return samples
+
+
+# Écriture des métriques du processus dans MULTIPROC_DIR (remplacement atomique du fichier)
+def write_snapshot():
+    if MULTIPROC_DIR is None:
+        return
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.values().items()] for metric in REGISTRY}
+    path = os.path.join(MULTIPROC_DIR, f"{os.getpid()}.json")
+    with open(f"{path}.{threading.get_ident()}.tmp", 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(f.name, path)
+
+
+# Métriques d'un processus terminé : gardées pour ses compteurs et histogrammes, plus pour ses jauges
+# (appelée par le processus maître, voir gunicorn.conf.py)
+def mark_process_dead(pid):
+    if MULTIPROC_DIR is None:
+        return
+    path = os.path.join(MULTIPROC_DIR, f"{pid}.json")
+    if os.path.exists(path):
+        os.replace(path, os.path.join(MULTIPROC_DIR, f"dead_{pid}.json"))
+
+
+# Valeurs de chaque métrique dans tous les processus : {nom: {pid: {libellés: valeur}}}
+# (processus terminés inclus, sauf pour les jauges)
+def _collect():
+    collected = {}
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.json')):
+        name = os.path.basename(path)[:-len('.json')]
+        dead = name.startswith('dead_')
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):  # fichier remplacé entre-temps
+            continue
+        for metric_name, values in snapshot.items():
+            process_values = {tuple(key): tuple(value) if isinstance(value, list) else value for key, value in values}
+            collected.setdefault(metric_name, []).append((name.removeprefix('dead_'), dead, process_values))
+    return collected
+
+
+# Texte de toutes les métriques enregistrées (de tous les processus si MULTIPROC_DIR est défini)
+def render():
+    if MULTIPROC_DIR is None:
+        return ''.join(metric.render() for metric in REGISTRY)
+    write_snapshot()
+    collected = _collect()
+    text = []
+    for metric in REGISTRY:
+        values = {pid: process_values for pid, dead, process_values in collected.get(metric.name, [])
+                  if not (dead and metric.type == 'gauge')}
+        text.append(metric.render(metric.merge(values)))
+    return ''.join(text)
+
+
+# Métriques de l'API
+REQUESTS = Counter('http_requests_total', "Requêtes traitées par route, méthode et code de statut",
+                   ['route', 'method', 'status'])
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Durée de traitement des requêtes par route",
+                            ['route', 'method'])
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', "Requêtes en cours de traitement")
+STAGE_SECONDS = Histogram('forecast_stage_duration_seconds', "Durée des étapes de calcul des prévisions",
+                          ['stage', 'model'])
+FORECASTS_IN_FLIGHT = Gauge('forecasts_in_flight', "Calculs de prévision en cours (en file ou en calcul)",
+                            ['model'])
+CACHE_HITS = Counter('forecast_cache_hits_total', "Prévisions servies depuis le cache")
+CACHE_MISSES = Counter('forecast_cache_misses_total', "Prévisions absentes du cache")
+FORECASTS_COALESCED = Counter('forecasts_coalesced_total',
+                              "Requêtes servies par un calcul identique déjà en cours")
+CACHE_HIT_RATIO = Gauge('forecast_cache_hit_ratio', "Part des prévisions servies depuis le cache")
+CACHE_ENTRIES = Gauge('forecast_cache_entries', "Prévisions en cache")
+FEATURE_CACHE_HITS = Counter('feature_cache_hits_total',
+                             "Variables de saisonnalité et de jours fériés lues dans le cache")
+FEATURE_CACHE_MISSES = Counter('feature_cache_misses_total',
+                               "Variables de saisonnalité et de jours fériés construites (absentes du cache)")
+MODELS_RESIDENT = Gauge('models_resident', "Modèles chargés en mémoire")
+DEPARTMENT_MODELS_RESIDENT = Gauge('department_models_resident', "Modèles départementaux chargés en mémoire")
+
+
+# Middleware ASGI comptant les requêtes, leur durée et les requêtes en cours par route (voir /metrics).
+# Une requête est terminée une fois son dernier message 'http.response.body' envoyé : la durée des réponses
+# en flux (prévisions en NDJSON ou en Arrow IPC, événements des tâches) inclut l'envoi de tout leur corps.
+# Une requête interrompue par une exception avant sa réponse est comptée avec le statut 500.
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        with REQUESTS_IN_FLIGHT.track():
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Route trouvée par le routeur de l'application dans le même 'scope'
+                route = scope.get('route')
+                path = route.path if route is not None else 'unmatched'
+                REQUESTS.inc(route=path, method=scope['method'], status=status)
+                REQUEST_SECONDS.observe(time.perf_counter() - start, route=path, method=scope['method'])
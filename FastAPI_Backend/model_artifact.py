@@ -0,0 +1,191 @@
+# Format binaire compact des modèles Prophet
+#
+# Les fichiers Prophet_model_*.json contiennent le modèle sérialisé par prophet.serialize, dont
+# l'historique et les paramètres sous forme de texte JSON (lent à relire). Le format binaire
+# (même nom, extension .bin) sépare :
+# - un en-tête JSON avec les attributs simples du modèle (format de prophet.serialize, sans les
+#   grands tableaux), la description des tableaux (type, forme, position dans le fichier) et, pour un
+#   modèle converti depuis un fichier JSON, l'empreinte SHA-256 de ce fichier ;
+# - les tableaux NumPy bruts (historique, dates, changepoints, paramètres...), alignés sur 64 octets.
+# À la lecture les tableaux sont projetés en mémoire (mmap) : ils ne sont lus qu'à l'usage et leurs
+# pages sont partagées entre les processus qui chargent le même fichier.
+#
+# Conversion des modèles JSON : python model_artifact.py [fichiers JSON...] (par défaut models/*.json)
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+from prophet.serialize import model_from_dict, model_to_dict
+
+from forecast_cache import file_hash
+
+MAGIC = b'PROPHBIN'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+ARTIFACT_SUFFIX = '.bin'
+
+# Attributs stockés sous forme de tableaux plutôt que dans l'en-tête
+ARRAY_ATTRIBUTES = ['history', 'history_dates', 'changepoints', 'changepoints_t', 'train_component_cols', 'params']
+
+
+# Chemin du modèle binaire correspondant à un modèle JSON
+def artifact_path(json_path):
+    return os.path.splitext(json_path)[0] + ARTIFACT_SUFFIX
+
+
+# Mémo des empreintes de fichier JSON lues dans les en-têtes : chemin -> ((mtime_ns, taille), empreinte)
+_source_hashes = {}
+
+
+# Vrai si le modèle binaire existe et a été converti depuis le contenu actuel du modèle JSON
+# (empreintes comparées plutôt que dates de modification : une copie qui conserve les dates est détectée)
+def is_current(artifact, json_path):
+    try:
+        stat = os.stat(artifact)
+    except FileNotFoundError:
+        return False
+    signature = (stat.st_mtime_ns, stat.st_size)
+    known = _source_hashes.get(artifact)
+    if known is None or known[0] != signature:
+        try:
+            known = (signature, _read_header(artifact)[0].get('source_hash'))
+        except (OSError, ValueError):
+            return False
+        _source_hashes[artifact] = known
+    return known[1] is not None and known[1] == file_hash(json_path)
+
+
+# En-tête d'un modèle au format binaire et position de ses tableaux dans le fichier
+def _read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} n'est pas un modèle Prophet au format binaire")
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Version de format non prise en charge : {header['format_version']}")
+    return header, -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+
+
+# Tableaux d'un modèle, indexés par nom ('history/y', 'params/beta'...), et description
+# des objets pandas à reconstruire à partir de ces tableaux
+def _model_arrays(model):
+    arrays = {'history/index': model.history.index.values}
+    for column in model.history.columns:
+        values = model.history[column].values
+        if values.dtype == object:
+            raise ValueError(f"Colonne non numérique dans l'historique : {column}")
+        arrays[f'history/{column}'] = values
+    arrays['history_dates'] = model.history_dates.values
+    if model.changepoints is not None:
+        arrays['changepoints'] = model.changepoints.values
+        arrays['changepoints/index'] = model.changepoints.index.values
+    arrays['changepoints_t'] = np.asarray(model.changepoints_t)
+    arrays['train_component_cols'] = model.train_component_cols.values
+    for name, values in model.params.items():
+        arrays[f'params/{name}'] = np.asarray(values)
+
+    frames = {
+        'history_columns': list(model.history.columns),
+        'component_cols': {
+            'index': list(model.train_component_cols.index),
+            'columns': list(model.train_component_cols.columns),
+        },
+    }
+    return {name: np.ascontiguousarray(values) for name, values in arrays.items()}, frames
+
+
+# Écriture d'un modèle Prophet ajusté au format binaire (écriture atomique : fichier temporaire au nom
+# unique dans le même dossier, puis renommage, pour qu'un processus en train de lire l'ancien fichier ne
+# soit pas perturbé et que deux écritures simultanées du même modèle ne se mélangent pas).
+# 'source_hash' : empreinte SHA-256 du fichier JSON dont le modèle a été lu (voir is_current)
+def save_artifact(model, path, source_hash=None):
+    arrays, frames = _model_arrays(model)
+    model_dict = model_to_dict(model)
+    for attribute in ARRAY_ATTRIBUTES:
+        model_dict[attribute] = None
+    model_dict['changepoints_t'] = []
+    model_dict['params'] = {}
+
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+        offset += values.nbytes
+
+    header = json.dumps({
+        'format_version': FORMAT_VERSION, 'model': model_dict, 'frames': frames, 'arrays': layout,
+        'source_hash': source_hash,
+    }).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for name, values in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(values.tobytes())
+            f.truncate(data_start + offset)
+        # mkstemp crée le fichier lisible par son seul propriétaire
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Lecture d'un modèle au format binaire, tableaux projetés en mémoire (lecture seule)
+def load_artifact(path):
+    header, data_start = _read_header(path)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        size = dtype.itemsize * int(np.prod(entry['shape']))
+        arrays[name] = np.asarray(buffer[start:start + size]).view(dtype).reshape(entry['shape'])
+
+    frames = header['frames']
+    model = model_from_dict(header['model'])
+    # copy=False : les colonnes de l'historique restent des vues des tableaux projetés en mémoire
+    model.history = pd.DataFrame(
+        {column: arrays[f'history/{column}'] for column in frames['history_columns']},
+        index=arrays['history/index'], copy=False,
+    )
+    model.history_dates = pd.Series(arrays['history_dates'], name='ds')
+    if 'changepoints' in arrays:
+        model.changepoints = pd.Series(arrays['changepoints'], index=arrays['changepoints/index'], name='ds')
+    model.changepoints_t = arrays['changepoints_t']
+    model.train_component_cols = pd.DataFrame(
+        arrays['train_component_cols'],
+        index=pd.Index(frames['component_cols']['index'], name='col'),
+        columns=pd.Index(frames['component_cols']['columns'], name='component'),
+    )
+    model.params = {name[len('params/'):]: values for name, values in arrays.items() if name.startswith('params/')}
+    return model
+
+
+# Conversion d'un modèle JSON (fichier Prophet_model_*.json) au format binaire, avec l'empreinte
+# du contenu effectivement converti
+def convert(json_path, path=None):
+    with open(json_path, 'rb') as f:
+        data = f.read()
+    model_dict = json.loads(json.loads(data))
+    path = path or artifact_path(json_path)
+    save_artifact(model_from_dict(model_dict), path, source_hash=hashlib.sha256(data).hexdigest())
+    return path
+
+
+if __name__ == '__main__':
+    for json_path in sys.argv[1:] or sorted(glob.glob(os.path.join('models', 'Prophet_model_*.json'))):
+        print(f"{json_path} -> {convert(json_path)}")
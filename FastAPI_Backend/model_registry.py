@@ -0,0 +1,238 @@
+# Registre des modèles Prophet servis par l'API
+#
+# Les modèles sont décrits par le manifeste models/manifest.json :
+#   {"nom du modèle": {"file": "Prophet_model_xxx.json", "regressors": "variable", "preload": true}, ...}
+# - 'file' : fichier du modèle dans le dossier des modèles (JSON, ou directement au format binaire .bin)
+# - 'regressors' : variable des régresseurs (data/{variable}_regressors.csv), par défaut le nom du modèle
+# - 'preload' : modèle chargé et prévision précalculée au démarrage de l'API
+# - 'clip_outliers' : à l'entraînement (training.py), valeurs aberrantes de la série ramenées aux bornes de Tukey
+# Sans manifeste, chaque fichier Prophet_model_*.json du dossier est servi sous le nom qui suit ce préfixe.
+#
+# Un modèle n'est chargé qu'à sa première utilisation (depuis sa version binaire si elle est à jour),
+# puis gardé en mémoire dans la limite de 'max_bytes' (0 : sans limite) : au-delà, les modèles
+# les moins récemment utilisés sont libérés et seront rechargés à leur prochaine utilisation.
+# Une nouvelle version d'un modèle en mémoire est chargée à part avec load(), puis mise en service
+# d'un seul coup avec install() : les requêtes en cours continuent d'utiliser l'ancienne version.
+
+from collections import OrderedDict
+from prophet.serialize import model_from_json
+import glob
+import json
+import os
+import threading
+import time
+
+import fast_engine
+import model_artifact
+from forecast_cache import file_hash
+
+MANIFEST_FILE = 'manifest.json'
+MODEL_PREFIX = 'Prophet_model_'
+
+
+# Fonction pour charger un modèle Prophet depuis un fichier JSON ou binaire (voir model_artifact.py)
+def load_model(file_name):
+    if file_name.endswith(model_artifact.ARTIFACT_SUFFIX):
+        return model_artifact.load_artifact(file_name)
+    with open(file_name, 'r') as f:
+        model = model_from_json(json.load(f))
+    return model
+
+
+# Estimation de la mémoire occupée par un modèle chargé (historique, composantes et paramètres)
+def model_size(model):
+    size = model.history.memory_usage(index=True, deep=True).sum()
+    size += model.train_component_cols.memory_usage(index=True, deep=True).sum()
+    size += sum(values.nbytes for values in model.params.values())
+    return int(size)
+
+
+class ModelRegistry:
+    def __init__(self, models_dir='models', max_bytes=0):
+        self.models_dir = models_dir
+        self.max_bytes = max_bytes
+        self._manifest = (None, {})
+        self._resident = OrderedDict()
+        self._lock = threading.RLock()
+        # Verrous de chargement par modèle (un seul chargement à la fois d'un même modèle)
+        self._loading = {}
+
+    def manifest_path(self):
+        return os.path.join(self.models_dir, MANIFEST_FILE)
+
+    # Entrées du manifeste, relu s'il a changé (à défaut, modèles JSON présents dans le dossier)
+    def manifest(self):
+        path = self.manifest_path()
+        if not os.path.exists(path):
+            pattern = os.path.join(self.models_dir, f"{MODEL_PREFIX}*.json")
+            return {
+                os.path.basename(file_name)[len(MODEL_PREFIX):-len('.json')]: {'file': os.path.basename(file_name)}
+                for file_name in sorted(glob.glob(pattern))
+            }
+        version = file_hash(path)
+        if self._manifest[0] != version:
+            with open(path, 'r') as f:
+                self._manifest = (version, json.load(f))
+        return self._manifest[1]
+
+    def names(self):
+        return list(self.manifest())
+
+    def __contains__(self, model_name):
+        return model_name in self.manifest()
+
+    # Modèles à charger au démarrage
+    def preloaded(self):
+        return [model_name for model_name, entry in self.manifest().items() if entry.get('preload')]
+
+    # Variable des régresseurs d'un modèle
+    def regressors(self, model_name):
+        return self.manifest()[model_name].get('regressors', model_name)
+
+    # Fichier déclaré dans le manifeste pour un modèle
+    def source_file(self, model_name):
+        return os.path.join(self.models_dir, self.manifest()[model_name]['file'])
+
+    # Fichier chargé pour un modèle : sa version binaire si elle est à jour, sinon le fichier déclaré
+    def model_file(self, model_name):
+        file_name = self.source_file(model_name)
+        artifact = model_artifact.artifact_path(file_name)
+        if artifact != file_name and model_artifact.is_current(artifact, file_name):
+            return artifact
+        return file_name
+
+    # Conversion au format binaire des modèles JSON dont la version binaire est absente ou périmée
+    # (sans effet si le dossier des modèles est en lecture seule ou si le fichier JSON est invalide,
+    # le modèle étant alors lu, ou rejeté, depuis ce fichier)
+    def convert_all(self):
+        for model_name in self.names():
+            file_name = self.source_file(model_name)
+            if file_name.endswith(model_artifact.ARTIFACT_SUFFIX):
+                continue
+            if not model_artifact.is_current(model_artifact.artifact_path(file_name), file_name):
+                try:
+                    model_artifact.convert(file_name)
+                except (OSError, ValueError, KeyError):
+                    pass
+
+    # Nouvelle entrée d'un modèle ({'model', 'spec', 'version', 'size'}) chargée depuis son fichier
+    # actuel, sans la mettre en mémoire
+    def load(self, model_name):
+        file_name = self.model_file(model_name)
+        version = file_hash(file_name)
+        model = load_model(file_name)
+        try:
+            spec = fast_engine.extract_spec(model)
+        except ValueError:
+            spec = None
+        return {'model': model, 'spec': spec, 'version': version, 'size': model_size(model)}
+
+    # Mise en service d'une entrée chargée avec load(), en remplacement de la version en mémoire
+    def install(self, model_name, entry):
+        with self._lock:
+            self._resident[model_name] = entry
+            self._touch(model_name, entry)
+
+    # Entrée d'un modèle en mémoire, chargée à sa première utilisation
+    # (une fois en mémoire, un modèle n'est remplacé que par install()).
+    # Le fichier est lu sans le verrou du registre : les autres modèles restent servis pendant le chargement.
+    def refresh(self, model_name):
+        with self._lock:
+            entry = self.lookup(model_name)
+            if entry is not None:
+                return entry
+            loading = self._loading.setdefault(model_name, threading.Lock())
+        with loading:
+            with self._lock:
+                entry = self._resident.get(model_name)
+            if entry is None:
+                entry = self.load(model_name)
+            with self._lock:
+                entry = self._resident.setdefault(model_name, entry)
+                self._touch(model_name, entry)
+        return entry
+
+    # Entrée d'un modèle s'il est en mémoire, sans le charger (None sinon)
+    def lookup(self, model_name):
+        with self._lock:
+            entry = self._resident.get(model_name)
+            if entry is not None:
+                self._touch(model_name, entry)
+            return entry
+
+    # Modèle marqué comme le plus récemment utilisé, puis libération des autres au-delà de la limite de mémoire
+    def _touch(self, model_name, entry):
+        entry['last_used'] = time.time()
+        self._resident.move_to_end(model_name)
+        self._evict(keep=model_name)
+
+    # Modèles en mémoire dont le fichier a changé sur le disque depuis leur chargement
+    def changed(self):
+        with self._lock:
+            resident = {model_name: entry['version'] for model_name, entry in self._resident.items()}
+        changed = []
+        for model_name, version in resident.items():
+            try:
+                if model_name in self and file_hash(self.model_file(model_name)) != version:
+                    changed.append(model_name)
+            except OSError:  # fichier en cours de remplacement, pris en compte au prochain passage
+                pass
+        return changed
+
+    # Libération des modèles retirés du manifeste ; retourne leurs noms
+    def prune(self):
+        with self._lock:
+            removed = [model_name for model_name in self._resident if model_name not in self]
+            for model_name in removed:
+                del self._resident[model_name]
+        return removed
+
+    # Libération d'un modèle en mémoire, rechargé depuis son fichier actuel à sa prochaine utilisation
+    def release(self, model_name):
+        with self._lock:
+            return self._resident.pop(model_name, None) is not None
+
+    # Modèles en mémoire
+    def resident(self):
+        with self._lock:
+            return list(self._resident)
+
+    # Libération des modèles les moins récemment utilisés jusqu'à respecter la limite de mémoire
+    def _evict(self, keep):
+        if not self.max_bytes:
+            return
+        total = sum(entry['size'] for entry in self._resident.values())
+        for model_name in list(self._resident):
+            if total <= self.max_bytes:
+                break
+            if model_name != keep:
+                total -= self._resident.pop(model_name)['size']
+
+    def version(self, model_name):
+        return self.refresh(model_name)['version']
+
+    def model(self, model_name):
+        return self.refresh(model_name)['model']
+
+    # Paramètres du modèle pour le moteur NumPy (None si le modèle n'est pas pris en charge)
+    def spec(self, model_name):
+        return self.refresh(model_name)['spec']
+
+    # État des modèles du manifeste : fichier, version, présence en mémoire et taille estimée
+    def status(self):
+        with self._lock:
+            resident = dict(self._resident)
+        status = []
+        for model_name in self.names():
+            entry = resident.get(model_name)
+            file_name = self.model_file(model_name)
+            status.append({
+                'name': model_name,
+                'file': file_name,
+                'version': file_hash(file_name),
+                'resident': entry is not None,
+                'resident_version': entry['version'] if entry else None,
+                'size_bytes': entry['size'] if entry else None,
+                'last_used': entry['last_used'] if entry else None,
+            })
+        return status
@@ -1,41 +1,283 @@
 # FastAPI pour le déploiement des modèles Prophet (page 8 de L'API Streamlit)
 
 # Importation des bibliothèques nécessaires
-from fastapi import FastAPI, HTTPException
-from prophet.serialize import model_from_json
+from fastapi import Depends, FastAPI, HTTPException, Path, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pydantic import BaseModel, Field
+from datetime import date
+from typing import Dict, List, Literal, Optional
+import asyncio
+import hashlib
 import json
+import logging
+import os
+import time
+
+import numpy as np
 import pandas as pd
 
+import fast_engine
+import feature_cache
+import forecasting
+import backtesting
+import compression
+import departments
+import metrics
+import serialization
+from forecast_cache import ForecastCache, SingleFlight
+from forecasting import registry
+from jobs import JobManager
+
 # Création de l'instance FastAPI
 app = FastAPI()
 
-# Dictionnaire global pour stocker les modèles chargés
-models = {}
+# Compression gzip des réponses pour les clients qui l'acceptent (niveau 6, par défaut de zlib :
+# le niveau 9 est plusieurs fois plus lent sur les réponses volumineuses pour un gain de taille négligeable),
+# sauf pour les événements des tâches (voir compression.py)
+app.add_middleware(compression.GZipMiddleware, minimum_size=1000, compresslevel=6)
+
+
+# Nombre, durée (jusqu'à la fin du corps des réponses en flux) et requêtes en cours par route (voir /metrics)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Noms courts des formats de réponse des prévisions (voir serialization.py)
+ResponseFormat = Literal['records', 'columns', 'arrow', 'parquet', 'ndjson']
+
+# Versions (empreinte du modèle, empreinte des régresseurs) connues de chaque modèle servi
+artifact_versions = {}
+
+# Horizon (en jours) des prévisions calculées pour chaque modèle : toute requête plus courte
+# est servie en découpant cette prévision (le curseur de la page 8 va de 1 à 365 jours)
+MAX_HORIZON = int(os.environ.get('MAX_HORIZON', 365))
+
+# Cache des prévisions, indexé par (modèle, version du modèle, version des régresseurs, horizon, moteur,
+# nombre de simulations, graine)
+forecast_cache = ForecastCache(max_entries=int(os.environ.get('FORECAST_CACHE_SIZE', 64)))
+
+# Calculs de prévision en cours, partagés par les requêtes identiques simultanées
+inflight = SingleFlight()
+
+# Nombre de processus du pool de calcul des prévisions (0 : calcul dans un thread du processus principal)
+PREDICTION_WORKERS = int(os.environ.get('PREDICTION_WORKERS', os.cpu_count() or 1))
+
+# Nombre maximal de scénarios évalués par requête de la route /scenarios
+MAX_SCENARIOS = int(os.environ.get('MAX_SCENARIOS', 1000))
+
+# Graine maximale des simulations (limite de np.random.seed, utilisé par Prophet et les backtests)
+MAX_SEED = 2**32 - 1
+
+# Nombre de lignes par morceau des réponses envoyées en flux
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', 100))
+
+# Durée (en secondes) pendant laquelle un client ou un proxy peut réutiliser une prévision sans la revalider
+FORECAST_MAX_AGE = int(os.environ.get('FORECAST_MAX_AGE', 60))
+
+# Intervalle (en secondes) de surveillance du dossier des modèles (0 : pas de surveillance,
+# rechargement uniquement par la route /admin/reload)
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 10))
+
+# Intervalle (en secondes) d'écriture des métriques du processus pour leur agrégation entre les workers
+# de gunicorn (voir metrics.py ; sans effet si METRICS_MULTIPROC_DIR n'est pas défini)
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 5))
+
+# Tâches de calcul asynchrones : nombre d'exécutants par processus et durée de conservation
+# (en secondes) des résultats, enregistrés dans le dossier jobs/
+jobs = JobManager('jobs', workers=int(os.environ.get('JOB_WORKERS', 1)),
+                  ttl=int(os.environ.get('JOB_TTL', 86400)))
+
+# Backtests des modèles (prévisions par coupure enregistrées dans le dossier backtests/)
+backtester = backtesting.Backtester()
 
-# Fonction pour charger un modèle Prophet depuis un fichier JSON
-def load_model(file_name):
-    with open(file_name, 'r') as f:
-        model = model_from_json(json.load(f))
-    return model
+# Exécuteur des calculs de prévision, créé au démarrage
+executor = None
 
-# Fonction pour charger les régresseurs depuis le répertoire "data"
-def load_regressors(variable):
-    regressors_path = f"data/{variable}_regressors.csv"
-    regressors = pd.read_csv(regressors_path).drop(columns=['Unnamed: 0'], axis=1)
-    regressors['ds'] = pd.to_datetime(regressors['ds'])  # Convertir la colonne 'ds' en datetime
-    return regressors
+# Tâches de surveillance du dossier des modèles et d'écriture des métriques, et verrou des rechargements
+watch_task = None
+metrics_task = None
+reload_lock = asyncio.Lock()
 
-# Cette fonction sera exécutée au démarrage de l'API pour charger tous les modèles
+logger = logging.getLogger(__name__)
+
+# Création de l'exécuteur : pool de processus initialisés avec les modèles chargés,
+# ou à défaut un unique thread (Prophet utilise le générateur aléatoire global de NumPy,
+# qui ne doit pas être partagé entre deux calculs simultanés d'un même processus)
+def create_executor():
+    if PREDICTION_WORKERS > 0:
+        return ProcessPoolExecutor(max_workers=PREDICTION_WORKERS, mp_context=forecasting.process_context(),
+                                   initializer=forecasting.init_worker)
+    return ThreadPoolExecutor(max_workers=1)
+
+# Entrée en mémoire d'un modèle ({'model', 'spec', 'version', ...}, voir ModelRegistry.refresh) : un modèle
+# absent de la mémoire (pas encore chargé, ou libéré depuis) est chargé dans un thread, sans bloquer la
+# boucle d'événements. Les routes lisent le modèle dans cette entrée plutôt que dans le registre.
+async def model_entry(model_name):
+    model_registry = forecasting.registry_of(model_name)
+    entry = model_registry.lookup(model_name)
+    if entry is None:
+        entry = await asyncio.get_running_loop().run_in_executor(None, model_registry.refresh, model_name)
+    return entry
+
+# Prise en compte d'une éventuelle nouvelle version du modèle ('entry' : son entrée en mémoire)
+# ou des régresseurs : les prévisions en cache d'un modèle sont invalidées dès que l'un de ses artefacts a changé
+def refresh_artifacts(model_name, entry):
+    versions = (entry['version'], forecasting.regressors_version(model_name))
+    if artifact_versions.get(model_name) != versions:
+        artifact_versions[model_name] = versions
+        forecast_cache.invalidate(model_name)
+    return versions
+
+# Calcul d'une prévision par l'exécuteur (arguments de forecasting.compute_forecast), avec enregistrement
+# de la durée de ses étapes : attente dans la file de l'exécuteur ('queue') et étapes du calcul
+async def run_forecast(model_name, *args):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    with metrics.FORECASTS_IN_FLIGHT.track(model=model_name):
+        forecast, timings = await loop.run_in_executor(executor, forecasting.timed_forecast, model_name, *args)
+    elapsed = time.perf_counter() - start
+    metrics.STAGE_SECONDS.observe(max(elapsed - sum(timings.values()), 0.0), stage='queue', model=model_name)
+    for stage, seconds in timings.items():
+        metrics.STAGE_SECONDS.observe(seconds, stage=stage, model=model_name)
+    return forecast
+
+# Clé du cache de la prévision sur l'horizon maximal d'un modèle
+# (samples = None : nombre de simulations du modèle)
+def forecast_key(model_name, entry, engine='prophet', samples=None, seed=0):
+    versions = refresh_artifacts(model_name, entry)
+    if samples is None:
+        samples = entry['model'].uncertainty_samples
+    return (model_name, *versions, MAX_HORIZON, engine, samples, seed)
+
+# Calcul, dans le processus courant, des prévisions précalculées au démarrage (modèles à précharger)
+# qui ne sont pas déjà en cache. Appelée par le processus maître de gunicorn avant la création des
+# workers (voir gunicorn.conf.py) : ils héritent de ces prévisions au lieu de les recalculer chacun.
+def precompute_forecasts():
+    for model_name in registry.preloaded():
+        key = forecast_key(model_name, registry.refresh(model_name))
+        if forecast_cache.get(key) is None:
+            forecast_cache.put(key, forecasting.compute_forecast(model_name, MAX_HORIZON, samples=key[-2]))
+
+# Prévision sur l'horizon maximal d'un modèle, calculée par l'exécuteur au premier appel
+# puis lue dans le cache ('dates' : grille de dates déjà construite, voir shared_future_dates).
+# Les requêtes identiques arrivant pendant le calcul attendent ce même calcul.
+async def get_forecast(model_name, engine='prophet', samples=None, seed=0, dates=None):
+    key = forecast_key(model_name, await model_entry(model_name), engine, samples, seed)
+    samples = key[-2]
+    forecast = forecast_cache.get(key)
+    if forecast is None:
+        async def compute():
+            forecast = await run_forecast(model_name, MAX_HORIZON, engine, samples, seed, dates)
+            forecast_cache.put(key, forecast)
+            return forecast
+
+        forecast = await inflight.run(key, compute)
+    return forecast
+
+# Rechargement sans interruption des modèles dont le fichier a changé (ou des modèles 'model_names') :
+# chaque nouvelle version est chargée et contrôlée par une prédiction en arrière-plan, pendant que
+# l'ancienne continue de servir. Une fois toutes les versions prêtes, elles sont mises en service, le pool
+# de calcul est remplacé par un nouveau, dont les processus chargent les nouvelles versions à leur démarrage
+# (l'ancien pool termine ses calculs en cours avant de s'arrêter), et le cache de leurs prévisions est
+# invalidé, le tout sans rendre la main à la boucle d'événements : une requête voit soit les anciennes
+# versions et l'ancien pool, soit les nouvelles et le nouveau pool, et une prévision de l'ancienne version
+# ne peut pas être mise en cache sous la version nouvelle.
+# Une version qui ne peut pas être chargée ou contrôlée n'est pas mise en service.
+# Sans liste de modèles, les modèles départementaux en mémoire dont le fichier a changé (ou qui ont été
+# retirés du magasin) sont libérés : leur nouvelle version est chargée à leur prochaine utilisation.
+async def reload_models(model_names=None):
+    global executor
+    scan = model_names is None
+    async with reload_lock:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, registry.convert_all)
+        if model_names is None:
+            model_names = await loop.run_in_executor(None, registry.changed)
+
+        # Chargement et contrôle des nouvelles versions
+        loaded, failed = {}, {}
+        for model_name in model_names:
+            try:
+                entry = await loop.run_in_executor(None, forecasting.registry_of(model_name).load, model_name)
+                await loop.run_in_executor(None, forecasting.warm_up, model_name, entry)
+            except Exception as error:
+                logger.warning("Rechargement du modèle %s impossible : %s", model_name, error)
+                failed[model_name] = str(error)
+                continue
+            loaded[model_name] = entry
+        changed_departments = []
+        if scan:
+            changed_departments = await loop.run_in_executor(None, forecasting.departments.changed)
+
+        # Mise en service (sans await jusqu'à l'invalidation du cache)
+        for model_name, entry in loaded.items():
+            forecasting.registry_of(model_name).install(model_name, entry)
+        removed = registry.prune()
+        released = []
+        if scan:
+            released = [model_name for model_name in changed_departments
+                        if forecasting.departments.release(model_name)]
+            released += forecasting.departments.prune()
+        if (loaded or removed or released) and PREDICTION_WORKERS > 0:
+            old_executor, executor = executor, create_executor()
+            loop.run_in_executor(None, old_executor.shutdown, True)
+        for model_name in [*loaded, *removed, *released]:
+            forecast_cache.invalidate(model_name)
+        reloaded = {model_name: entry['version'] for model_name, entry in loaded.items()}
+
+        # Prévisions des modèles préchargés recalculées avec leur nouvelle version
+        preloaded = registry.preloaded()
+        await asyncio.gather(*(get_forecast(model_name) for model_name in reloaded if model_name in preloaded))
+    return {'reloaded': reloaded, 'failed': failed, 'removed': removed, 'released': released}
+
+# Surveillance du dossier des modèles : rechargement des modèles dont le fichier a changé
+async def watch_models():
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            await reload_models()
+        except Exception:
+            logger.exception("Échec de la surveillance du dossier des modèles")
+
+# Écriture régulière des métriques du processus (agrégées par la route /metrics de n'importe quel worker)
+async def write_metrics():
+    while True:
+        await asyncio.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            update_metrics()
+            metrics.write_snapshot()
+        except OSError:
+            logger.exception("Échec de l'écriture des métriques")
+
+# Cette fonction sera exécutée au démarrage de l'API pour charger les modèles à précharger,
+# démarrer le pool de calcul et précalculer leurs prévisions sur l'horizon maximal
+# (les autres modèles du manifeste sont chargés à leur première utilisation)
 @app.on_event("startup")
 async def load_models_on_startup():
-    global models
-    models = {
-        'total_accidents': load_model('models/Prophet_model_tot_acc.json'),
-        'gravite_accident_tué': load_model('models/Prophet_model_acc_tués.json'),
-        'gravite_accident_blessé_léger': load_model('models/Prophet_model_acc_legers.json'),
-        'gravite_accident_blessé_hospitalisé': load_model('models/Prophet_model_acc_hosp.json'),
-        'gravite_accident_indemne': load_model('models/Prophet_model_acc_indemnes.json')
-    }
+    global executor, watch_task, metrics_task
+    # Les modèles sont convertis au format binaire si besoin, puis chargés ; les processus du pool les
+    # chargent depuis les mêmes fichiers (leurs tableaux projetés en mémoire sont partagés)
+    registry.convert_all()
+    forecasting.init_worker()
+    executor = create_executor()
+    await asyncio.gather(*(get_forecast(model_name) for model_name in registry.preloaded()))
+    if MODEL_WATCH_INTERVAL > 0:
+        watch_task = asyncio.create_task(watch_models())
+    if metrics.MULTIPROC_DIR is not None:
+        metrics.write_snapshot()
+        metrics_task = asyncio.create_task(write_metrics())
+    jobs.start()
+
+# Arrêt des tâches, de la surveillance des modèles, de l'écriture des métriques (écrites une dernière fois)
+# et du pool de calcul à l'arrêt de l'API
+@app.on_event("shutdown")
+def shutdown_executor():
+    jobs.stop()
+    for task in (watch_task, metrics_task):
+        if task is not None:
+            task.cancel()
+    metrics.write_snapshot()
+    executor.shutdown(wait=False, cancel_futures=True)
+
 # Route pour la page d'accueil
 @app.get("/")
 def read_root():
@@ -45,27 +287,572 @@ def read_root():
     }
 
 
-# Route pour effectuer des prédictions en utilisant un modèle spécifié
-@app.post("/predict/{model_name}/{days}")
-async def predict(model_name: str, days: int):
-    if model_name not in models:
+# Format de la réponse négocié à partir de l'en-tête Accept ou du paramètre 'format'
+# (stream : réponse demandée en flux)
+def negotiate_format(request, format, stream=False):
+    media_type = serialization.negotiate(request.headers.get('accept'), format, stream)
+    if media_type is None:
+        available = serialization.streaming_media_types() if stream else serialization.available_media_types()
+        raise HTTPException(status_code=406, detail=f"Formats disponibles : {', '.join(available)}")
+    return media_type
+
+
+# Vérifie qu'un modèle (national ou départemental) existe et qu'il est pris en charge par le moteur demandé ;
+# retourne son entrée en mémoire (voir model_entry)
+async def check_model(model_name, engine):
+    if model_name not in registry and model_name not in forecasting.departments:
         raise HTTPException(status_code=404, detail=f"Modèle {model_name} introuvable")
-    
-    # Chargement des régresseurs
-    regressors = load_regressors(model_name)
+    entry = await model_entry(model_name)
+    if engine == 'fast' and entry['spec'] is None:
+        raise HTTPException(status_code=400, detail=f"Le moteur 'fast' ne prend pas en charge le modèle {model_name}")
+    return entry
+
+
+# Lignes demandées d'une prévision du modèle de l'entrée 'entry' : l'historique (si include_history),
+# puis 'days' jours futurs, le tout restreint à la fenêtre de dates [start, end]
+def select_rows(forecast, entry, days, start=None, end=None, include_history=True):
+    n_history = len(entry['model'].history_dates)
+    forecast = forecast.iloc[(0 if include_history else n_history):n_history + days]
+    ds = forecast['ds'].values
+    first = 0 if start is None else ds.searchsorted(np.datetime64(start, 'ns'))
+    last = len(ds) if end is None else ds.searchsorted(np.datetime64(end, 'ns'), side='right')
+    return forecast.iloc[first:last]
+
+
+# Colonnes demandées d'une prévision ('ds' est toujours incluse)
+def select_columns(forecast, columns):
+    if not columns:
+        return forecast
+    unknown = [column for column in columns if column not in forecast.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Colonnes inconnues : {', '.join(unknown)}")
+    return forecast[['ds'] + [column for column in dict.fromkeys(columns) if column != 'ds']]
+
+
+# Dates des lignes demandées d'une prévision (voir select_rows)
+def forecast_window(entry, days, start=None, end=None, include_history=True):
+    grid = pd.DataFrame({'ds': fast_engine.make_future_dates(entry['spec'], days)})
+    return select_rows(grid, entry, days, start, end, include_history)['ds'].values
+
+
+# Prévision restreinte aux lignes et colonnes demandées.
+# Avec le moteur NumPy sans intervalles, seules ces lignes et composantes sont calculées
+# (un seul calcul pour les requêtes identiques simultanées) ;
+# sinon elles sont découpées dans la prévision sur l'horizon maximal (calculée ou en cache).
+async def get_selected_forecast(model_name, engine, samples, seed, days, start=None, end=None,
+                                include_history=True, columns=None, dates=None):
+    entry = await model_entry(model_name)
+    if engine == 'fast' and samples == 0:
+        versions = refresh_artifacts(model_name, entry)
+        window = forecast_window(entry, days, start, end, include_history)
+        key = (model_name, *versions, 'window', days, seed, start, end, include_history,
+               None if columns is None else tuple(columns))
+        forecast = await inflight.run(key, lambda: run_forecast(model_name, days, engine, 0, seed, window, columns))
+    else:
+        forecast = await get_forecast(model_name, engine, samples, seed, dates)
+        with metrics.STAGE_SECONDS.time(stage='select', model=model_name):
+            forecast = select_rows(forecast, entry, days, start, end, include_history)
+    return select_columns(forecast, columns)
+
+
+# Même prévision, découpée en morceaux de STREAM_CHUNK_ROWS lignes (au moins un morceau, éventuellement vide).
+# Avec le moteur NumPy sans intervalles, chaque morceau est calculé au moment où il est envoyé.
+async def iter_selected_forecast(model_name, engine, samples, seed, days, start=None, end=None,
+                                 include_history=True, columns=None, dates=None):
+    entry = await model_entry(model_name)
+    if engine == 'fast' and samples == 0:
+        refresh_artifacts(model_name, entry)
+        window = forecast_window(entry, days, start, end, include_history)
+        for first in range(0, max(len(window), 1), STREAM_CHUNK_ROWS):
+            chunk = await run_forecast(model_name, days, engine, 0, seed, window[first:first + STREAM_CHUNK_ROWS],
+                                       columns)
+            yield select_columns(chunk, columns)
+    else:
+        forecast = await get_forecast(model_name, engine, samples, seed, dates)
+        with metrics.STAGE_SECONDS.time(stage='select', model=model_name):
+            forecast = select_rows(forecast, entry, days, start, end, include_history)
+        forecast = select_columns(forecast, columns)
+        for first in range(0, max(len(forecast), 1), STREAM_CHUNK_ROWS):
+            yield forecast.iloc[first:first + STREAM_CHUNK_ROWS]
+
+
+# Premier morceau d'un flux, calculé avant l'envoi de la réponse pour que les erreurs
+# soient retournées avec leur code HTTP, et le flux complet
+async def prime(chunks):
+    first = await anext(chunks)
+
+    async def chained():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return first, chained()
+
+
+# ETag faible d'une prévision : empreinte des versions des artefacts (modèles et régresseurs)
+# et des paramètres de la requête, dont le format de la réponse.
+# Une prévision ne change que si l'un de ces éléments change (les simulations sont tirées avec une graine).
+# L'ETag est faible car la même prévision est envoyée compressée ou non (voir compression.py) :
+# les deux réponses sont équivalentes sans être identiques octet par octet.
+def forecast_etag(versions, *params):
+    digest = hashlib.sha256(repr((MAX_HORIZON, versions, params)).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+# En-têtes de cache HTTP des réponses de prévision
+def cache_headers(etag):
+    return {'ETag': etag, 'Cache-Control': f'public, max-age={FORECAST_MAX_AGE}', 'Vary': 'Accept'}
+
+
+# Vrai si le client possède déjà la prévision (en-tête If-None-Match, comparaison faible)
+def not_modified(request, etag):
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+# Réponse à une requête conditionnelle dont le client possède déjà la prévision : 304 pour GET et HEAD,
+# 412 (condition non remplie) pour les autres méthodes ; None si la prévision doit être envoyée
+def precondition_response(request, etag, headers):
+    if not not_modified(request, etag):
+        return None
+    status_code = 304 if request.method in ('GET', 'HEAD') else 412
+    return Response(status_code=status_code, headers=headers)
+
+
+# Réponse envoyée en flux : morceaux (nom du modèle, DataFrame) encodés au fur et à mesure
+# ('model' : nom du modèle des métriques lorsque les morceaux n'en portent pas) ;
+# avec gzip, chaque morceau est compressé et envoyé dès qu'il est encodé (voir compression.py)
+def streaming_response(chunks, media_type, headers, columns=None, model=None):
+    async def body():
+        encoder = serialization.StreamEncoder(media_type, columns)
+        async for model_name, chunk in chunks:
+            with metrics.STAGE_SECONDS.time(stage='serialize', model=model_name or model):
+                data = encoder.encode(chunk, model_name)
+            yield data
+        yield encoder.close()
+
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+
+# Route pour effectuer des prédictions en utilisant un modèle spécifié.
+# Par défaut la réponse contient les 'days' jours prévus, avec toutes les colonnes de Prophet ;
+# include_history=true y ajoute l'historique (utilisé par la page 8 pour ses graphiques), et 'columns'
+# (liste séparée par des virgules), 'start' et 'end' permettent de ne demander que les colonnes et la
+# période utiles.
+# En NDJSON, ou avec stream=true (NDJSON ou Arrow IPC), la réponse est envoyée en flux.
+# La réponse porte un ETag : si le client envoie le même dans If-None-Match, la prévision n'est ni
+# recalculée ni renvoyée (réponse 304 en GET, la méthode à utiliser pour les requêtes conditionnelles
+# et les caches HTTP intermédiaires ; 412 en POST, accepté pour les anciens clients).
+@app.api_route("/predict/{model_name}/{days}", methods=["GET", "POST"])
+async def predict(request: Request, model_name: str, days: int = Path(ge=0, le=MAX_HORIZON),
+                  engine: Literal['prophet', 'fast'] = 'prophet',
+                  samples: int = Query(None, ge=0, le=10000), seed: int = Query(0, ge=0, le=MAX_SEED),
+                  columns: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None,
+                  include_history: bool = False, format: Optional[ResponseFormat] = None, stream: bool = False):
+    entry = await check_model(model_name, engine)
+    media_type = negotiate_format(request, format, stream)
+    if columns is not None:
+        columns = [column.strip() for column in columns.split(',') if column.strip()]
+
+    etag = forecast_etag(refresh_artifacts(model_name, entry), model_name, days, engine, samples, seed, columns,
+                         start, end, include_history, media_type, stream)
+    headers = cache_headers(etag)
+    precondition = precondition_response(request, etag, headers)
+    if precondition is not None:
+        return precondition
+
+    if stream or media_type == serialization.NDJSON:
+        _, chunks = await prime(iter_selected_forecast(model_name, engine, samples, seed, days,
+                                                       start, end, include_history, columns))
+        return streaming_response(((None, chunk) async for chunk in chunks), media_type, headers, model=model_name)
+
+    forecast = await get_selected_forecast(model_name, engine, samples, seed, days,
+                                           start, end, include_history, columns)
+
+    # Retourner le résultat dans le format demandé (par défaut une liste d'enregistrements JSON)
+    with metrics.STAGE_SECONDS.time(stage='serialize', model=model_name):
+        body = serialization.encode(forecast, media_type)
+    return Response(content=body, media_type=media_type, headers=headers)
 
-    # Création du DataFrame future
-    future = models[model_name].make_future_dataframe(periods=days, freq='D', include_history=True)
 
-    # Fusion de future avec les régresseurs sur la colonne 'ds'
-    future = pd.merge(future, regressors, on='ds', how='left')
+# Corps de la requête de prévision groupée
+class BatchRequest(BaseModel):
+    models: List[str] = Field(default_factory=registry.names, min_length=1)
+    days: int = Field(MAX_HORIZON, ge=0, le=MAX_HORIZON)
+    engine: Literal['prophet', 'fast'] = 'prophet'
+    samples: Optional[int] = Field(None, ge=0, le=10000)
+    seed: int = Field(0, ge=0, le=MAX_SEED)
+    columns: Optional[List[str]] = None
+    start: Optional[date] = None
+    end: Optional[date] = None
+    include_history: bool = False
+    stream: bool = False
+
+
+# Route pour prédire plusieurs séries en un seul appel (par défaut tous les modèles du manifeste).
+# La grille de dates est construite une seule fois et les modèles sont évalués en parallèle ;
+# en JSON la réponse associe à chaque modèle sa prévision, en Arrow ou Parquet les prévisions
+# sont empilées avec une colonne 'model'.
+# En flux, les modèles sont envoyés l'un après l'autre, chaque ligne portant le nom de son modèle ;
+# le premier morceau de chaque modèle est calculé avant l'envoi pour fixer les colonnes du flux Arrow.
+@app.post("/predict_batch")
+async def predict_batch(http_request: Request, request: BatchRequest, format: Optional[ResponseFormat] = None):
+    model_names = list(dict.fromkeys(request.models))
+    entries = await asyncio.gather(*(check_model(model_name, request.engine) for model_name in model_names))
+    media_type = negotiate_format(http_request, format, request.stream)
+
+    versions = [refresh_artifacts(model_name, entry) for model_name, entry in zip(model_names, entries)]
+    etag = forecast_etag(versions, model_names, request.model_dump(exclude={'models'}), media_type)
+    headers = cache_headers(etag)
+    precondition = precondition_response(http_request, etag, headers)
+    if precondition is not None:
+        return precondition
+
+    dates = forecasting.shared_future_dates([entry['model'] for entry in entries], MAX_HORIZON)
+    if request.stream or media_type == serialization.NDJSON:
+        primed = await asyncio.gather(*(
+            prime(iter_selected_forecast(model_name, request.engine, request.samples, request.seed, request.days,
+                                         request.start, request.end, request.include_history, request.columns,
+                                         dates))
+            for model_name in model_names
+        ))
+        columns = None
+        if media_type == serialization.ARROW_STREAM:
+            columns = list(dict.fromkeys(['model'] + [column for first, _ in primed for column in first.columns]))
+
+        async def chunks():
+            for model_name, (_, model_chunks) in zip(model_names, primed):
+                async for chunk in model_chunks:
+                    yield model_name, chunk
+
+        return streaming_response(chunks(), media_type, headers, columns)
+
+    body = await compute_batch(request, model_names, media_type, dates)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+# Prévisions ponctuelles de plusieurs modèles calculées ensemble par le moteur NumPy, en un seul appel
+# à l'exécuteur (moteur 'fast' sans intervalles) ; None si les modèles n'ont pas les mêmes dates demandées
+async def get_stacked_forecasts(model_names, days, start=None, end=None, include_history=True, columns=None):
+    entries = await asyncio.gather(*(model_entry(model_name) for model_name in model_names))
+    windows = [forecast_window(entry, days, start, end, include_history) for entry in entries]
+    if any(not np.array_equal(window, windows[0]) for window in windows[1:]):
+        return None
+    versions = tuple(refresh_artifacts(model_name, entry) for model_name, entry in zip(model_names, entries))
+    key = ('stacked', tuple(model_names), versions, days, start, end, include_history,
+           None if columns is None else tuple(columns))
+
+    async def compute():
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        with metrics.FORECASTS_IN_FLIGHT.track(model='stacked'):
+            forecasts, timings = await loop.run_in_executor(executor, forecasting.timed_stacked, model_names,
+                                                            windows[0], columns)
+        elapsed = time.perf_counter() - start_time
+        metrics.STAGE_SECONDS.observe(max(elapsed - sum(timings.values()), 0.0), stage='queue', model='stacked')
+        for stage, seconds in timings.items():
+            metrics.STAGE_SECONDS.observe(seconds, stage=stage, model='stacked')
+        return forecasts
+
+    forecasts = await inflight.run(key, compute)
+    return [select_columns(forecast, columns) for forecast in forecasts]
+
+
+# Prévisions groupées encodées dans le format 'media_type' ('progress' : fonction appelée avec
+# la part des modèles déjà calculés, pour les tâches asynchrones).
+# Avec le moteur NumPy sans intervalles, les modèles sont évalués ensemble (voir get_stacked_forecasts).
+async def compute_batch(request, model_names, media_type, dates=None, progress=None):
+    forecasts = None
+    if request.engine == 'fast' and request.samples == 0 and len(model_names) > 1:
+        forecasts = await get_stacked_forecasts(model_names, request.days, request.start, request.end,
+                                                request.include_history, request.columns)
+    if forecasts is not None:
+        if progress is not None:
+            progress(1.0, f"{len(model_names)} modèles calculés")
+        with metrics.STAGE_SECONDS.time(stage='serialize', model='batch'):
+            return serialization.encode_batch(dict(zip(model_names, forecasts)), media_type)
+
+    async def selected(model_name):
+        forecast = await get_selected_forecast(model_name, request.engine, request.samples, request.seed,
+                                               request.days, request.start, request.end, request.include_history,
+                                               request.columns, dates)
+        done.append(model_name)
+        if progress is not None:
+            progress(len(done) / len(model_names), f"{model_name} calculé")
+        return forecast
+
+    done = []
+    forecasts = await asyncio.gather(*(selected(model_name) for model_name in model_names))
+    with metrics.STAGE_SECONDS.time(stage='serialize', model='batch'):
+        return serialization.encode_batch(dict(zip(model_names, forecasts)), media_type)
+
+
+# Route pour soumettre une prévision groupée en tâche asynchrone (mêmes paramètres que /predict_batch,
+# hors envoi en flux) : la réponse contient l'identifiant de la tâche, à suivre avec /jobs/{job_id}
+@app.post("/jobs/predict_batch", status_code=202)
+async def submit_predict_batch(http_request: Request, request: BatchRequest, format: Optional[ResponseFormat] = None):
+    model_names = list(dict.fromkeys(request.models))
+    await asyncio.gather(*(check_model(model_name, request.engine) for model_name in model_names))
+    media_type = negotiate_format(http_request, format)
+
+    async def run(progress):
+        entries = await asyncio.gather(*(model_entry(model_name) for model_name in model_names))
+        dates = forecasting.shared_future_dates([entry['model'] for entry in entries], MAX_HORIZON)
+        return await compute_batch(request, model_names, media_type, dates, progress), media_type
+
+    return jobs.submit('predict_batch', run, {**request.model_dump(mode='json'), 'models': model_names})
+
+
+# État d'une tâche (404 si elle n'existe pas)
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Tâche {job_id} introuvable")
+    return status
+
+
+# Route pour suivre une tâche : état, progression et, une fois terminée, erreur éventuelle
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return job_status(job_id)
+
+
+# Route pour suivre une tâche en continu (Server-Sent Events) : un événement à chaque changement d'état,
+# jusqu'à la fin de la tâche
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job_status(job_id)
+
+    async def events():
+        last = None
+        while True:
+            status = jobs.status(job_id)
+            if status != last:
+                yield f"data: {json.dumps(status)}\n\n"
+                last = status
+            if status['status'] in ('done', 'failed'):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# Route pour récupérer le résultat d'une tâche terminée, dans le format demandé à sa soumission
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    status = job_status(job_id)
+    if status['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Tâche {job_id} non terminée (état : {status['status']})")
+    return FileResponse(jobs.result_path(job_id), media_type=status['media_type'])
+
+
+# Scénario de régresseurs : chaque valeur d'un régresseur est multipliée par son facteur 'scale'
+# puis augmentée de son décalage 'shift' (par exemple {"scale": {"trajet_trajet_personnel": 0.8}}
+# pour 20 % de trajets personnels en moins)
+class Scenario(BaseModel):
+    name: str
+    scale: Dict[str, float] = {}
+    shift: Dict[str, float] = {}
+
+
+# Corps de la requête de scénarios : 'days' jours prévus, restreints à la fenêtre [start, end] ;
+# 'curves' : ajout des prévisions journalières de chaque scénario à son total
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario] = Field(min_length=1, max_length=MAX_SCENARIOS)
+    days: int = Field(MAX_HORIZON, ge=1, le=MAX_HORIZON)
+    start: Optional[date] = None
+    end: Optional[date] = None
+    curves: bool = True
+
+
+# Évaluation des scénarios d'un modèle par l'exécuteur, en une seule passe du moteur NumPy ;
+# retourne, pour la référence et pour chaque scénario, le total prévu sur la période, l'écart
+# au total de référence et (si demandé) la prévision journalière, arrondie au centième
+async def compute_scenarios(model_name, request):
+    entry = await model_entry(model_name)
+    refresh_artifacts(model_name, entry)
+    dates = forecast_window(entry, request.days, request.start, request.end, include_history=False)
+    overrides = [(scenario.scale, scenario.shift) for scenario in request.scenarios]
+    loop = asyncio.get_running_loop()
+    with metrics.STAGE_SECONDS.time(stage='scenarios', model=model_name):
+        base, yhat = await loop.run_in_executor(executor, forecasting.compute_scenarios, model_name, dates, overrides)
+
+    baseline = {'total': float(base.sum())}
+    totals = yhat.sum(axis=0)
+    results = [
+        {'name': scenario.name, 'total': float(total), 'delta': float(total) - baseline['total']}
+        for scenario, total in zip(request.scenarios, totals)
+    ]
+    if request.curves:
+        baseline['yhat'] = base.round(2).tolist()
+        for result, curve in zip(results, yhat.T.round(2).tolist()):
+            result['yhat'] = curve
+    return {
+        'model': model_name,
+        'ds': pd.DatetimeIndex(dates).strftime('%Y-%m-%d').tolist() if request.curves else None,
+        'baseline': baseline,
+        'scenarios': results,
+    }
+
+
+# Vérifie que les régresseurs modifiés par les scénarios sont ceux du modèle
+async def check_scenarios(model_name, request):
+    entry = await check_model(model_name, 'fast')
+    regressors = entry['spec']['regressors']
+    unknown = sorted({name for scenario in request.scenarios for name in (*scenario.scale, *scenario.shift)}
+                     - set(regressors))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Régresseurs inconnus : {', '.join(unknown)} "
+                                                    f"(régresseurs du modèle : {', '.join(regressors)})")
+
+
+# Route pour évaluer des scénarios (« et si ») sur les régresseurs d'un modèle, par exemple +10 % de
+# piétons heurtés ou −20 % de trajets professionnels : les scénarios ne modifient que les régresseurs
+# des jours prévus et sont tous évalués en une passe vectorisée du moteur NumPy (valeurs ponctuelles).
+# Le résultat, qui peut compter des centaines de courbes, est encodé directement en JSON.
+@app.post("/scenarios/{model_name}")
+async def scenarios(model_name: str, request: ScenarioRequest):
+    await check_scenarios(model_name, request)
+    result = await compute_scenarios(model_name, request)
+    return Response(content=json.dumps(result), media_type='application/json')
+
+
+# Route pour soumettre une évaluation de scénarios en tâche asynchrone (voir /scenarios/{model_name})
+@app.post("/jobs/scenarios/{model_name}", status_code=202)
+async def submit_scenarios(model_name: str, request: ScenarioRequest):
+    await check_scenarios(model_name, request)
+
+    async def run(progress):
+        return json.dumps(await compute_scenarios(model_name, request)), 'application/json'
+
+    return jobs.submit('scenarios', run, {'model': model_name, **request.model_dump(mode='json')})
+
+
+# Paramètres d'un backtest : horizon évalué, jours d'entraînement avant la première coupure,
+# écart entre deux coupures (par défaut la moitié de l'horizon) et graine des simulations
+class BacktestParams(BaseModel):
+    horizon: int = Field(90, ge=1, le=backtesting.MAX_HORIZON)
+    initial: int = Field(365, ge=1)
+    period: Optional[int] = Field(None, ge=1)
+    seed: int = Field(0, ge=0, le=MAX_SEED)
+
+
+# Paramètres d'un backtest lus dans la requête : limites vérifiées par FastAPI (réponse 422),
+# le modèle n'étant construit qu'une fois les valeurs validées
+def backtest_params(horizon: int = Query(90, ge=1, le=backtesting.MAX_HORIZON), initial: int = Query(365, ge=1),
+                    period: Optional[int] = Query(None, ge=1), seed: int = Query(0, ge=0, le=MAX_SEED)):
+    return BacktestParams(horizon=horizon, initial=initial, period=period, seed=seed)
+
+
+# Version du modèle et coupures d'un backtest (400 si l'historique du modèle est trop court)
+def backtest_plan(model_name, params):
+    if model_name not in registry:
+        raise HTTPException(status_code=404, detail=f"Modèle {model_name} introuvable")
+    if params.period is None:
+        params.period = max(params.horizon // 2, 1)
+    try:
+        return backtester.plan(model_name, params.horizon, params.initial, params.period)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+# Route pour lancer le backtest d'un modèle en tâche asynchrone : les coupures dont la prévision n'est pas
+# encore enregistrée sont réentraînées en parallèle, puis les métriques sont calculées (résultat JSON)
+@app.post("/jobs/backtests/{model_name}", status_code=202)
+async def submit_backtest(model_name: str, params: BacktestParams = Depends(backtest_params)):
+    backtest_plan(model_name, params)
+
+    async def run(progress):
+        report = await backtester.run(model_name, params.horizon, params.initial, params.period, params.seed,
+                                      progress)
+        return json.dumps(report), 'application/json'
+
+    return jobs.submit('backtest', run, {'model': model_name, **params.model_dump()})
+
+
+# Route pour lire les métriques (MAE, MAPE, couverture par horizon) d'un backtest déjà calculé
+# pour la version actuelle du modèle (404 s'il reste des coupures à entraîner : voir /jobs/backtests)
+@app.get("/backtests/{model_name}")
+def get_backtest(model_name: str, params: BacktestParams = Depends(backtest_params)):
+    version, plan = backtest_plan(model_name, params)
+    missing = backtester.missing(model_name, version, plan, params.seed)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Backtest incomplet ({len(missing)} coupures sur {len(plan)} "
+                                                    f"à entraîner) : lancer POST /jobs/backtests/{model_name}")
+    return backtester.report(model_name, version, plan, params.horizon, params.initial, params.period, params.seed)
+
+
+# Route pour lister les modèles du manifeste : fichier, version, présence en mémoire et taille estimée
+@app.get("/models")
+def list_models():
+    return registry.status()
+
+
+# Route pour lister les modèles départementaux (magasin models/departments/, voir departments.py), avec leur
+# département, sa série et leur présence en mémoire ; 'series' et 'department' filtrent la liste
+@app.get("/departments")
+def list_departments(series: Optional[str] = None, department: Optional[str] = None):
+    resident = set(forecasting.departments.resident())
+    return [
+        {'name': model_name, 'department': entry['department'], 'nom_dep': entry.get('nom_dep'),
+         'series': entry['series'], 'version': entry.get('version'), 'resident': model_name in resident}
+        for model_name, entry in forecasting.departments.manifest().items()
+        if (series is None or entry['series'] == series) and (department is None or entry['department'] == department)
+    ]
+
+
+# Route pour la prévision d'une série ('total_accidents', 'gravite_accident_tué'...) d'un département :
+# mêmes paramètres et même réponse que /predict/{model_name}/{days} pour le modèle {série}_{département},
+# chargé à sa première utilisation. Pour plusieurs départements en un appel, /predict_batch accepte
+# les noms des modèles départementaux (évalués ensemble par le moteur 'fast' sans intervalles).
+@app.api_route("/departments/{department}/{series}/{days}", methods=["GET", "POST"])
+async def predict_department(request: Request, department: str, series: str,
+                             days: int = Path(ge=0, le=MAX_HORIZON), engine: Literal['prophet', 'fast'] = 'prophet',
+                             samples: int = Query(None, ge=0, le=10000), seed: int = Query(0, ge=0, le=MAX_SEED),
+                             columns: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None,
+                             include_history: bool = False, format: Optional[ResponseFormat] = None,
+                             stream: bool = False):
+    model_name = departments.model_name(department, series)
+    if model_name not in forecasting.departments:
+        raise HTTPException(status_code=404, detail=f"Pas de modèle {series} pour le département {department}")
+    return await predict(request, model_name, days, engine, samples, seed, columns, start, end, include_history,
+                         format, stream)
+
+
+# Route pour recharger sans interruption les modèles dont le fichier a changé
+# (ou un modèle donné, national ou départemental, même si son fichier n'a pas changé)
+@app.post("/admin/reload")
+async def reload(model_name: str = None):
+    if model_name is not None and model_name not in registry and model_name not in forecasting.departments:
+        raise HTTPException(status_code=404, detail=f"Modèle {model_name} introuvable")
+    return await reload_models(None if model_name is None else [model_name])
 
-    # Effectuer la prédiction
-    forecast = models[model_name].predict(future)
 
-    # Retourner le résultat sous forme de dictionnaire
-    return forecast.to_dict(orient='records')
+# Route des métriques au format texte de Prometheus
+@app.get("/metrics")
+def get_metrics():
+    update_metrics()
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
+# Mise à jour des métriques tenues par ailleurs (caches et modèles en mémoire du processus)
+def update_metrics():
+    hits, misses = forecast_cache.hits, forecast_cache.misses
+    metrics.CACHE_HITS.set(hits)
+    metrics.CACHE_MISSES.set(misses)
+    metrics.CACHE_HIT_RATIO.set(hits / (hits + misses) if hits + misses else 0.0)
+    metrics.CACHE_ENTRIES.set(len(forecast_cache))
+    metrics.FEATURE_CACHE_HITS.set(feature_cache.cache.hits)
+    metrics.FEATURE_CACHE_MISSES.set(feature_cache.cache.misses)
+    metrics.FORECASTS_COALESCED.set(inflight.coalesced)
+    metrics.MODELS_RESIDENT.set(sum(model['resident'] for model in registry.status()))
+    metrics.DEPARTMENT_MODELS_RESIDENT.set(len(forecasting.departments.resident()))
 
 
+# Route pour vider le cache des prévisions (d'un modèle ou de tous les modèles)
+@app.delete("/cache")
+def clear_cache(model_name: str = None):
+    return {"invalidated": forecast_cache.invalidate(model_name)}
@@ -0,0 +1,52 @@
+# Stockage en mémoire des régresseurs (fichiers data/{variable}_regressors.csv)
+
+import os
+import threading
+
+import pandas as pd
+
+from forecast_cache import file_hash
+
+
+# Fonction pour lire un fichier de régresseurs : index 'ds' en datetime, valeurs en float32
+# (la colonne 'y' n'est pas utile à la prédiction)
+def read_regressors(path):
+    regressors = pd.read_csv(path, index_col='ds', parse_dates=['ds'])
+    regressors = regressors.drop(columns=['Unnamed: 0', 'y'], errors='ignore')
+    return regressors.astype('float32')
+
+
+# Les tables sont lues une seule fois puis gardées en mémoire ; elles ne sont relues
+# que si l'empreinte du fichier change (nouveau fichier déposé dans le volume data/)
+class RegressorStore:
+    def __init__(self, data_dir='data'):
+        self.data_dir = data_dir
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def path(self, variable):
+        return os.path.join(self.data_dir, f"{variable}_regressors.csv")
+
+    # Retourne (version, table) d'une variable en relisant le fichier s'il a changé
+    def refresh(self, variable):
+        path = self.path(variable)
+        version = file_hash(path)
+        entry = self._tables.get(variable)
+        if entry is None or entry[0] != version:
+            with self._lock:
+                entry = self._tables.get(variable)
+                if entry is None or entry[0] != version:
+                    entry = (version, read_regressors(path))
+                    self._tables[variable] = entry
+        return entry
+
+    def version(self, variable):
+        return self.refresh(variable)[0]
+
+    def get(self, variable):
+        return self.refresh(variable)[1]
+
+    # Lecture des tables de plusieurs variables (au démarrage d'un processus, voir forecasting.init_worker)
+    def load_all(self, variables):
+        for variable in variables:
+            self.refresh(variable)
@@ -0,0 +1,198 @@
+# Encodage des prévisions dans le format demandé par le client
+#
+# Formats disponibles (négociés avec l'en-tête Accept ou forcés avec le paramètre 'format') :
+# - 'records' : liste JSON d'enregistrements, un objet par jour (format historique de l'API)
+# - 'columns' : objet JSON colonne par colonne, sans répétition des noms de colonnes
+# - 'arrow'   : flux Arrow IPC
+# - 'parquet' : fichier Parquet
+# - 'ndjson'  : une ligne JSON par jour, envoyée en flux
+# Les réponses en flux (NDJSON, ou Arrow IPC avec stream=true) sont encodées morceau par morceau
+# avec StreamEncoder, un lot d'enregistrements Arrow ou un bloc de lignes NDJSON par morceau.
+# La compression gzip des réponses est assurée par le middleware GZip de l'API.
+
+import io
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # formats binaires indisponibles sans pyarrow
+    pa = None
+
+JSON_RECORDS = 'application/json'
+JSON_COLUMNS = 'application/vnd.forecast.columns+json'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+PARQUET = 'application/vnd.apache.parquet'
+NDJSON = 'application/x-ndjson'
+
+# Noms courts des formats (paramètre 'format' des routes)
+FORMATS = {
+    'records': JSON_RECORDS,
+    'columns': JSON_COLUMNS,
+    'arrow': ARROW_STREAM,
+    'parquet': PARQUET,
+    'ndjson': NDJSON,
+}
+
+# Autres types MIME acceptés pour ces formats
+ALIASES = {
+    'application/x-parquet': PARQUET,
+    'application/vnd.apache.arrow.file': ARROW_STREAM,
+    'application/jsonl': NDJSON,
+}
+
+
+# Types MIME pouvant être produits (les formats Arrow et Parquet nécessitent pyarrow)
+def available_media_types():
+    if pa is None:
+        return [JSON_RECORDS, JSON_COLUMNS, NDJSON]
+    return list(FORMATS.values())
+
+
+# Types MIME pouvant être envoyés en flux
+def streaming_media_types():
+    return [media_type for media_type in available_media_types() if media_type in (NDJSON, ARROW_STREAM)]
+
+
+# Choix du format de la réponse : le paramètre 'format' l'emporte sur l'en-tête Accept,
+# dont les types sont essayés par préférence (q) décroissante.
+# Avec stream=True, seuls les formats pouvant être envoyés en flux sont retenus (NDJSON par défaut).
+# Retourne None si aucun des types demandés ne peut être produit.
+def negotiate(accept=None, format=None, stream=False):
+    available = streaming_media_types() if stream else available_media_types()
+    default = NDJSON if stream else JSON_RECORDS
+    if format is not None:
+        media_type = FORMATS.get(format)
+        return media_type if media_type in available else None
+    if not accept:
+        return default
+
+    candidates = []
+    for position, item in enumerate(accept.split(',')):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, position, ALIASES.get(media_type.lower(), media_type.lower())))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in ('*/*', 'application/*'):
+            return default
+        if media_type in available:
+            return media_type
+    return None
+
+
+# Colonnes d'une prévision encodées en JSON, colonne par colonne
+def _json_columns(forecast):
+    parts = []
+    for column in forecast.columns:
+        values = forecast[column].to_json(orient='values', date_format='iso', date_unit='s')
+        parts.append(f"{json.dumps(column)}:{values}")
+    return "{" + ",".join(parts) + "}"
+
+
+# Lignes NDJSON d'une prévision (chaque ligne se termine par un saut de ligne)
+def _ndjson(forecast):
+    if forecast.empty:
+        return ''
+    return forecast.to_json(orient='records', lines=True, date_format='iso', date_unit='s')
+
+
+# Prévision précédée d'une colonne 'model' contenant le nom du modèle
+def _with_model(forecast, name):
+    forecast = forecast.assign(model=name)
+    forecast.insert(0, 'model', forecast.pop('model'))
+    return forecast
+
+
+# Table Arrow d'une prévision
+def _arrow_table(forecast):
+    return pa.Table.from_pandas(forecast, preserve_index=False)
+
+
+# Table Arrow encodée en flux IPC ou en Parquet
+def _encode_table(table, media_type):
+    if media_type == ARROW_STREAM:
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd')
+    return buffer.getvalue()
+
+
+# Encodage d'une prévision (DataFrame) dans le format 'media_type'
+def encode(forecast, media_type):
+    if media_type == JSON_RECORDS:
+        return forecast.to_json(orient='records', date_format='iso', date_unit='s')
+    if media_type == JSON_COLUMNS:
+        return _json_columns(forecast)
+    if media_type == NDJSON:
+        return _ndjson(forecast)
+    return _encode_table(_arrow_table(forecast), media_type)
+
+
+# Encodage des prévisions de plusieurs modèles ({nom du modèle: DataFrame}).
+# En JSON, la réponse associe à chaque modèle sa prévision ; en Arrow et Parquet,
+# les prévisions sont empilées dans une seule table avec une colonne 'model'
+# (en NDJSON, chaque ligne porte de même le nom de son modèle).
+def encode_batch(forecasts, media_type):
+    if media_type in (JSON_RECORDS, JSON_COLUMNS):
+        parts = [f"{json.dumps(name)}:{encode(forecast, media_type)}" for name, forecast in forecasts.items()]
+        return "{" + ",".join(parts) + "}"
+    if media_type == NDJSON:
+        return "".join(_ndjson(_with_model(forecast, name)) for name, forecast in forecasts.items())
+    stacked = pd.concat(
+        [_with_model(forecast, name) for name, forecast in forecasts.items()], ignore_index=True
+    )
+    return _encode_table(_arrow_table(stacked), media_type)
+
+
+# Encodage en flux d'une suite de morceaux de prévision (DataFrames).
+# En NDJSON chaque morceau donne un bloc de lignes ; en Arrow IPC le premier morceau fixe le schéma
+# du flux et chaque morceau donne un lot d'enregistrements ('columns' : colonnes imposées au flux,
+# les colonnes absentes d'un morceau étant complétées par des valeurs nulles).
+# close() retourne la fin du flux.
+class StreamEncoder:
+    def __init__(self, media_type, columns=None):
+        self.media_type = media_type
+        self.columns = columns
+        self._sink = io.BytesIO()
+        self._schema = None
+        self._writer = None
+
+    # Octets écrits par le flux Arrow depuis le dernier appel
+    def _drain(self):
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def encode(self, chunk, model=None):
+        if model is not None:
+            chunk = _with_model(chunk, model)
+        if self.columns is not None:
+            chunk = chunk.reindex(columns=self.columns)
+        if self.media_type == NDJSON:
+            return _ndjson(chunk).encode()
+        table = pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        self._writer.write_table(table)
+        return self._drain()
+
+    def close(self):
+        if self._writer is None:
+            return b''
+        self._writer.close()
+        return self._drain()
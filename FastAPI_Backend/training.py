@@ -0,0 +1,243 @@
+# Pipeline d'entraînement des modèles Prophet servis par l'API
+#
+# 1. Séries journalières : avec --accidents, les données brutes (un usager accidenté par ligne, comme
+#    data/df_accidents.csv produit par le notebook TS_1) sont agrégées par jour, variables catégorielles
+#    encodées en indicatrices (sommes) et heure médiane, puis l'historique des fichiers
+#    data/{variable}_regressors.csv est mis à jour (les valeurs futures des régresseurs sont conservées).
+#    Sans --accidents, les séries sont lues dans ces fichiers (jours où 'y' est renseigné).
+# 2. Entraînement : chaque modèle du manifeste est réentraîné, avec la configuration de sa version
+#    actuelle (saisonnalités, jours fériés, régresseurs, a priori), dans un pool de processus.
+#    Lorsque la série prolonge l'historique du modèle actuel (nouveaux jours ajoutés), l'optimisation
+#    part des paramètres actuels (démarrage à chaud) ; un modèle dont la série n'a pas changé n'est
+#    pas réentraîné (sauf --force).
+# 3. Artefacts : les modèles sont écrits dans models/versions/{version}/ (JSON et binaire, voir
+#    model_artifact.py) avec training.json (données, démarrage à chaud, durée d'entraînement de
+#    chaque modèle), puis le manifeste models/manifest.json est mis à jour pour pointer vers eux :
+#    l'API les met en service sans redémarrage (surveillance du dossier des modèles).
+#    --publish copie aussi les modèles, sous leur nom habituel, dans un autre dossier (page Streamlit).
+#
+# Exemples :
+#   python training.py
+#   python training.py --accidents ../Streamlit_Frontend/data/df_accidents.csv --publish ../Streamlit_Frontend/models
+#   python training.py --models total_accidents,gravite_accident_tué --cold --workers 2
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from prophet.diagnostics import prophet_copy
+from prophet.serialize import model_to_json
+
+import model_artifact
+from model_registry import ModelRegistry, load_model
+from regressor_store import RegressorStore
+
+VERSIONS_DIR = 'versions'
+TRAINING_FILE = 'training.json'
+
+# Modalités de la gravité dont la somme donne la série 'total_accidents' (notebook TS_1)
+GRAVITY_COLUMNS = ['gravite_accident_blessé_hospitalisé', 'gravite_accident_blessé_léger',
+                   'gravite_accident_indemne', 'gravite_accident_tué']
+
+
+# Séries journalières à partir des données brutes : indicatrices des variables catégorielles
+# sommées par jour (même nommage que l'encodage du notebook TS_1 : {variable}_{modalité}),
+# heure médiane et total des accidentés
+def daily_series(accidents_path):
+    df = pd.read_csv(accidents_path, parse_dates=['date'], low_memory=False)
+    df = df.drop(columns=['Unnamed: 0', 'datetime', 'latitude', 'longitude'], errors='ignore')
+    df = df[df['gravite_accident'] != 'autre']
+    categorical = df.select_dtypes(include='object').columns
+    daily = pd.get_dummies(df[categorical], prefix_sep='_', dtype=float).groupby(df['date']).sum()
+    daily['heure'] = df.groupby('date')['heure'].median()
+    daily['total_accidents'] = daily.reindex(columns=GRAVITY_COLUMNS, fill_value=0).sum(axis=1)
+    return daily.asfreq('D', fill_value=0).rename_axis('ds')
+
+
+# Mise à jour d'un fichier de régresseurs (ds, y, régresseurs) avec les séries journalières : les jours
+# qu'elles couvrent sont remplacés, les jours antérieurs et postérieurs (valeurs futures des régresseurs)
+# sont conservés
+def update_regressors(path, variable, daily):
+    current = pd.read_csv(path, index_col=0, parse_dates=['ds'])
+    columns = [column for column in current.columns if column not in ('ds', 'y')]
+    history = daily.reindex(columns=[variable] + columns, fill_value=0).rename(columns={variable: 'y'})
+    before = current[current['ds'] < history.index.min()]
+    after = current[current['ds'] > history.index.max()]
+    updated = pd.concat([before, history.reset_index(), after], ignore_index=True)
+    updated.to_csv(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+# Série d'entraînement d'un modèle : jours observés (où 'y' est renseigné) de son fichier de régresseurs,
+# avec si demandé les valeurs aberrantes ramenées aux bornes Q1 - 1,5 × IQR et Q3 + 1,5 × IQR
+def training_frame(path, model, clip_outliers=False):
+    df = pd.read_csv(path, index_col='ds', parse_dates=['ds'])
+    df = df.loc[df['y'].notna(), ['y', *model.extra_regressors]].astype(float).reset_index()
+    if clip_outliers:
+        q1, q3 = df['y'].quantile([0.25, 0.75])
+        df['y'] = df['y'].clip(q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+    return df
+
+
+# Paramètres du modèle actuel comme point de départ de l'optimisation (démarrage à chaud)
+def stan_init(model):
+    return {
+        'k': float(model.params['k'][0][0]),
+        'm': float(model.params['m'][0][0]),
+        'sigma_obs': float(model.params['sigma_obs'][0][0]),
+        'delta': np.asarray(model.params['delta'][0], dtype=float),
+        'beta': np.asarray(model.params['beta'][0], dtype=float),
+    }
+
+
+# Vrai si la série prolonge l'historique du modèle actuel (mêmes jours et mêmes valeurs, puis de nouveaux jours)
+def extends_history(model, df):
+    history = model.history[['ds', 'y']].reset_index(drop=True)
+    head = df[['ds', 'y']].iloc[:len(history)].reset_index(drop=True)
+    return bool(len(df) >= len(history) and head['ds'].equals(history['ds']) and (head['y'] == history['y']).all())
+
+
+# Entraînement d'un modèle (exécuté dans un processus du pool) : nouveau modèle de même configuration
+# que le modèle actuel 'current_file', entraîné sur 'df' ; retourne (modèle JSON, informations)
+def fit_model(current_file, df, warm=True):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    current = load_model(current_file)
+    warm = warm and current.mcmc_samples == 0 and extends_history(current, df)
+    model = prophet_copy(current)
+    start = time.perf_counter()
+    model.fit(df, **({'init': stan_init(current)} if warm else {}))
+    info = {
+        'rows': len(df),
+        'first_date': f"{df['ds'].min():%Y-%m-%d}",
+        'last_date': f"{df['ds'].max():%Y-%m-%d}",
+        'warm_start': warm,
+        'fit_seconds': round(time.perf_counter() - start, 3),
+    }
+    return model_to_json(model), info
+
+
+# Écriture atomique du manifeste, une ligne par modèle
+def write_manifest(path, manifest):
+    lines = [f"    {json.dumps(name, ensure_ascii=False)}: {json.dumps(entry, ensure_ascii=False)}"
+             for name, entry in manifest.items()]
+    with open(f"{path}.tmp", 'w') as f:
+        f.write('{\n' + ',\n'.join(lines) + '\n}\n')
+    os.replace(f"{path}.tmp", path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Entraînement des modèles Prophet")
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--accidents', help="données brutes à agréger par jour (format de df_accidents.csv)")
+    parser.add_argument('--models', help="modèles à entraîner, séparés par des virgules (par défaut tous)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cold', action='store_true', help="sans démarrage à chaud")
+    parser.add_argument('--force', action='store_true', help="réentraîner aussi les modèles dont la série n'a pas changé")
+    parser.add_argument('--publish', action='append', default=[],
+                        help="dossier où copier les modèles entraînés sous leur nom habituel (option répétable)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    registry = ModelRegistry(args.models_dir)
+    store = RegressorStore(args.data_dir)
+    model_names = args.models.split(',') if args.models else registry.names()
+    unknown = [model_name for model_name in model_names if model_name not in registry]
+    if unknown:
+        raise SystemExit(f"Modèles inconnus : {', '.join(unknown)}")
+
+    if args.accidents:
+        daily = daily_series(args.accidents)
+        for variable in dict.fromkeys(registry.regressors(model_name) for model_name in model_names):
+            update_regressors(store.path(variable), variable, daily)
+        print(f"Séries journalières mises à jour du {daily.index.min():%Y-%m-%d} au {daily.index.max():%Y-%m-%d}")
+
+    # Séries d'entraînement ; les modèles dont la série est celle de leur version actuelle sont ignorés
+    frames, skipped = {}, []
+    for model_name in model_names:
+        current = registry.model(model_name)
+        variable = registry.regressors(model_name)
+        df = training_frame(store.path(variable), current, registry.manifest()[model_name].get('clip_outliers', False))
+        if not args.force and len(df) == len(current.history) and extends_history(current, df):
+            skipped.append(model_name)
+        else:
+            frames[model_name] = df
+    for model_name in skipped:
+        print(f"{model_name} : série inchangée, modèle conservé")
+    if not frames:
+        return
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    directory = os.path.join(args.models_dir, VERSIONS_DIR, version)
+    os.makedirs(directory)
+    training = {'version': version, 'created': datetime.now(timezone.utc).isoformat(), 'models': {}}
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(frames)), mp_context=context) as pool:
+        futures = {
+            pool.submit(fit_model, registry.model_file(model_name), df, not args.cold): model_name
+            for model_name, df in frames.items()
+        }
+        failed = {}
+        for future in as_completed(futures):
+            model_name = futures[future]
+            try:
+                model_json, info = future.result()
+            except Exception as error:
+                failed[model_name] = str(error)
+                print(f"{model_name} : échec de l'entraînement ({error}), modèle conservé", flush=True)
+                continue
+            file_name = os.path.basename(registry.source_file(model_name))
+            path = os.path.join(directory, file_name)
+            with open(path, 'w') as f:
+                json.dump(model_json, f)
+            model_artifact.convert(path)
+            variable = registry.regressors(model_name)
+            training['models'][model_name] = {
+                'file': os.path.join(VERSIONS_DIR, version, file_name),
+                'previous': registry.manifest()[model_name]['file'],
+                'data': {'file': os.path.basename(store.path(variable)), 'version': store.version(variable)},
+                **info,
+            }
+            print(f"{model_name} : {info['rows']} jours jusqu'au {info['last_date']}, "
+                  f"{'démarrage à chaud' if info['warm_start'] else 'démarrage à froid'}, "
+                  f"entraîné en {info['fit_seconds']:.2f} s", flush=True)
+
+    if not training['models']:
+        shutil.rmtree(directory)
+        raise SystemExit(1)
+    training['failed'] = failed
+    training['wall_seconds'] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(directory, TRAINING_FILE), 'w') as f:
+        json.dump(training, f, indent=2, ensure_ascii=False)
+
+    # Publication : copies sous le nom habituel, puis manifeste de l'API (écrit en dernier)
+    for target in args.publish:
+        for model_name, entry in training['models'].items():
+            shutil.copyfile(os.path.join(args.models_dir, entry['file']),
+                            os.path.join(target, os.path.basename(entry['file'])))
+    manifest = {model_name: dict(entry) for model_name, entry in registry.manifest().items()}
+    for model_name, entry in training['models'].items():
+        manifest[model_name].update(file=entry['file'], version=version)
+    write_manifest(registry.manifest_path(), manifest)
+
+    print(f"Version {version} : {len(training['models'])} modèles entraînés en {training['wall_seconds']:.2f} s "
+          f"(durées d'entraînement cumulées : {sum(e['fit_seconds'] for e in training['models'].values()):.2f} s)")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
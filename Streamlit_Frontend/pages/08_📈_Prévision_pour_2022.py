@@ -7,11 +7,21 @@ import time
 from PIL import Image
 import plotly.graph_objs as go
 import os
+import sys
 from prophet.plot import plot_plotly
 from prophet.serialize import model_from_json
 import json
+import hashlib
+
+# model_artifact.py est le module de l'API (FastAPI_Backend), copié dans l'image Docker de l'application
+# avec forecast_cache.py dont il dépend (voir Streamlit_Frontend/Dockerfile) ; hors Docker, il est lu
+# dans le dossier de l'API
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'FastAPI_Backend'))
+import model_artifact
 import calendar
 from urllib.parse import quote
+from collections import OrderedDict
+import threading
 import requests
 
 ############################
@@ -74,14 +84,46 @@ def load_data():
 
 data = load_data()
 
-# Fonction pour charger les modèles à partir des fichiers JSON
-@st.cache_data
+# Fonction pour charger les modèles : depuis leur version binaire (voir model_artifact.py),
+# créée à partir du fichier JSON si elle est absente ou convertie depuis un autre contenu
+@st.cache_resource
 def load_model(file_name):
     file_path = os.path.join('models', file_name)
-    with open(file_path, 'r') as f:
-        model = model_from_json(json.load(f))
+    artifact = model_artifact.artifact_path(file_path)
+    if model_artifact.is_current(artifact, file_path):
+        return model_artifact.load_artifact(artifact)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    model = model_from_json(json.loads(data))
+    try:
+        model_artifact.save_artifact(model, artifact, source_hash=hashlib.sha256(data).hexdigest())
+    except OSError:
+        pass
     return model
 
+# Prévisions déjà reçues de l'API, partagées entre les sessions : {url: (ETag, prévision)}, limitées aux
+# MAX_FORECAST_RESPONSES plus récemment utilisées (une par variable et par horizon demandés au plus)
+MAX_FORECAST_RESPONSES = 32
+
+@st.cache_resource
+def forecast_responses():
+    return OrderedDict(), threading.Lock()
+
+def get_forecast_response(url):
+    responses, lock = forecast_responses()
+    with lock:
+        if url in responses:
+            responses.move_to_end(url)
+        return responses.get(url)
+
+def put_forecast_response(url, etag, predictions):
+    responses, lock = forecast_responses()
+    with lock:
+        responses[url] = (etag, predictions)
+        responses.move_to_end(url)
+        while len(responses) > MAX_FORECAST_RESPONSES:
+            responses.popitem(last=False)
+
 # Chargement des modèles
 models = {
     'total_accidents': load_model('Prophet_model_tot_acc.json'),
@@ -227,13 +269,24 @@ if run_prediction:
     # Encodage du nom de la variable pour l'URL
     encoded_variable = quote(variable)
 
-    # Appel à l'API FastAPI
-    response = requests.post(f"http://fastapi:8000/predict/{encoded_variable}/{days}")
+    # Appel à l'API FastAPI (historique et prévision, encodés colonne par colonne et compressés en gzip).
+    # Si la prévision a déjà été reçue, son ETag est renvoyé : l'API répond 304 si elle n'a pas changé.
+    url = f"http://fastapi:8000/predict/{encoded_variable}/{days}?include_history=true"
+    headers = {"Accept": "application/vnd.forecast.columns+json"}
+    cached = get_forecast_response(url)
+    if cached is not None:
+        headers["If-None-Match"] = cached[0]
+    response = requests.get(url, headers=headers)
 
     # Vérifier si la requête a réussi
-    if response.status_code == 200:
-        predictions = response.json()
-        
+    if response.status_code in (200, 304):
+        if response.status_code == 304:
+            predictions = cached[1]
+        else:
+            predictions = response.json()
+            if 'ETag' in response.headers:
+                put_forecast_response(url, response.headers['ETag'], predictions)
+
         # Transformation du JSON en DataFrame
         forecast = pd.DataFrame(predictions)
         forecast['ds'] = pd.to_datetime(forecast['ds']) # Convertir la colonne 'ds' en datetime